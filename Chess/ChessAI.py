@@ -1,97 +1,877 @@
+import multiprocessing
+import os
 import random
-
-piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-
-knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
-                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
-                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
-                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
-                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
-                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
-
-bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
-                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
-                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
-                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
-                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
-                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
-
-rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
-               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
-
-queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
-                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
-
-pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
-               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
-               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
-               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
-               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
-               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
-               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
-               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
-
-piece_position_scores = {"wN": knight_scores,
-                         "bN": knight_scores[::-1],
-                         "wB": bishop_scores,
-                         "bB": bishop_scores[::-1],
-                         "wQ": queen_scores,
-                         "bQ": queen_scores[::-1],
-                         "wR": rook_scores,
-                         "bR": rook_scores[::-1],
-                         "wp": pawn_scores,
-                         "bp": pawn_scores[::-1]}
+import time
+import ChessEngine
 
 CHECKMATE = 1000
 STALEMATE = 0
+DRAW = 0  # repetitions, the fifty-move rule and insufficient material
+TABLEBASE_WIN = CHECKMATE / 2  # a position the tablebases know is won, less a little for every half move to mate
 DEPTH = 3
+MAX_DEPTH = 32  # iterative deepening limit when searching on a time or node budget
+MAX_PLY = 64
+
+# most valuable victim - least valuable attacker, the king is the least welcome attacker
+mvv_lva_values = {"K": 10, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+# the same values indexed like the piece fields of a move code (ChessEngine.MOVE_PIECES) and its promotion piece
+mvv_lva_piece_values = [mvv_lva_values[piece[1]] if piece != "--" else 0 for piece in ChessEngine.MOVE_PIECES]
+mvv_lva_promotion_values = [mvv_lva_values[piece] for piece in ChessEngine.Move.promotion_pieces]
+
+# a capture in the quiescence search that can't bring the score within this margin of alpha is skipped
+DELTA_MARGIN = 2
+
+# null-move pruning: a position where even passing the turn fails high in a search NULL_MOVE_REDUCTION plies
+# shallower is cut off. 0 turns it off, findBestMove takes other reductions
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+# late-move reductions: quiet moves ordered after the first LATE_MOVE_MIN_NUMBER are searched LATE_MOVE_REDUCTION
+# plies shallower and only searched again to full depth if they beat alpha. 0 turns them off as well
+LATE_MOVE_REDUCTION = 1
+LATE_MOVE_MIN_DEPTH = 3
+LATE_MOVE_MIN_NUMBER = 3
+# width of the windows that only test whether a score beats a bound, less than any two scores differ by
+NULL_WINDOW = 0.001
+# every depth after the first is searched with a window this far around the score of the depth before,
+# and with a window twice as wide each time the score falls outside
+ASPIRATION_WINDOW = 0.5
+
+# bound types of transposition table scores
+EXACT = 0
+LOWER_BOUND = 1  # the search failed high, the real score is at least this
+UPPER_BOUND = 2  # the search failed low, the real score is at most this
+
+
+class TranspositionTable:
+    """
+    Fixed-size table of search results keyed by GameState.zobrist_hash.
+    Entries are tuples (key, depth, score, bound, best_move, generation), scores are from the side to move's view
+    and best_move is a move code.
+    """
+
+    def __init__(self, size=2 ** 18):
+        # size must be a power of two, the low bits of the hash pick the slot
+        self.mask = size - 1
+        self.entries = [None] * size
+        self.generation = 0
+
+    def newSearch(self):
+        """
+        Age the stored entries so that results of earlier searches are replaced first.
+        """
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * len(self.entries)
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, best_move):
+        """
+        Store a search result. A slot keeps its entry only against shallower results from the current search
+        for a different position, everything else (empty, same position or left over from an older search) is replaced.
+        """
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, score, bound, best_move, self.generation)
+
+
+transposition_table = TranspositionTable()  # the searches use it unless they are given another one
+opening_book = None  # a ChessBook.OpeningBook, positions found in it are played from the book without a search
+tablebases = None  # a ChessTablebase.Tablebases, probed at the root and inside the search
+
+
+def historyKey(move):
+    """
+    The piece moved and end square of a move code.
+    """
+    return ((move >> ChessEngine.PIECE_MOVED_SHIFT) & 15) << 6 | (move >> 6) & 63
+
+
+def orderMoves(moves, hash_move, search, ply):
+    """
+    Sort the moves so the most promising come first: the hash move, captures and promotions by MVV-LVA,
+    killer moves of this ply and then the remaining quiet moves by history score.
+    The sort is stable, so moves that score the same keep their previous order.
+    """
+    killers = search.killer_moves[ply]
+    history_scores = search.history_scores
+    capture_or_promotion = -1 << ChessEngine.PIECE_CAPTURED_SHIFT | ChessEngine.PROMOTION_FLAG
+
+    def moveOrderKey(move):
+        if move == hash_move:
+            return 3, 0
+        if move & capture_or_promotion:
+            return 2, mvvLvaScore(move)
+        if move == killers[0]:
+            return 1, 1
+        if move == killers[1]:
+            return 1, 0
+        return 0, history_scores.get(historyKey(move), 0)
+
+    moves.sort(key=moveOrderKey, reverse=True)
+
+
+def pickMoves(game_state, hash_move, search, ply):
+    """
+    The legal moves of the position as move codes, handed out in stages as the search asks for them: the hash move,
+    captures and promotions that don't lose material by MVV-LVA, the killer moves of this ply, the quiet moves by
+    history score and last the captures that do. The hash move is checked on its own, so a node that cuts off on it
+    never generates its moves, and the later stages are only sorted once the search gets to them.
+    Like getValidMoveCodes it sets checkmate or stalemate when there are no moves at all.
+    """
+    if hash_move is not None:
+        game_state.updateMoveMasks()
+        if game_state.isValidMoveCode(hash_move):
+            yield hash_move
+    moves = generateMoves(game_state)  # the searches of the moves before change the masks, this sets them again
+    enemy_attacks = game_state.enemy_attacks
+    captures = []
+    quiets = []
+    for move in moves:
+        if move == hash_move:
+            continue
+        if move >> ChessEngine.PIECE_CAPTURED_SHIFT or move & ChessEngine.PROMOTION_FLAG:
+            captures.append(move)
+        else:
+            quiets.append(move)
+    captures.sort(key=mvvLvaScore, reverse=True)
+    losing_captures = []
+    for move in captures:
+        # a piece taking a cheaper one on a square the opponent covers can be taken back
+        if not move & ChessEngine.PROMOTION_FLAG and enemy_attacks >> ((move >> 6) & 63) & 1 and \
+                mvv_lva_piece_values[move >> ChessEngine.PIECE_CAPTURED_SHIFT] < \
+                mvv_lva_piece_values[(move >> ChessEngine.PIECE_MOVED_SHIFT) & 15]:
+            losing_captures.append(move)
+        else:
+            yield move
+    killers = [move for move in search.killer_moves[ply] if move is not None and move != hash_move and move in quiets]
+    for move in killers:
+        yield move
+    history_scores = search.history_scores
+    quiets.sort(key=lambda move: history_scores.get(historyKey(move), 0), reverse=True)
+    for move in quiets:
+        if move not in killers:
+            yield move
+    yield from losing_captures
+
+
+def mvvLvaScore(move):
+    """
+    Most valuable victim - least valuable attacker score of a capture or promotion code, a promotion counts the
+    promoted piece as part of the victim.
+    """
+    victim = mvv_lva_piece_values[move >> ChessEngine.PIECE_CAPTURED_SHIFT]
+    if move & ChessEngine.PROMOTION_FLAG:
+        victim += mvv_lva_promotion_values[(move >> ChessEngine.PROMOTION_SHIFT) & 3]
+    return 10 * victim - mvv_lva_piece_values[(move >> ChessEngine.PIECE_MOVED_SHIFT) & 15]
+
+
+def storeQuietCutoff(move, depth, search, ply):
+    """
+    Remember a quiet move that caused a beta cutoff as a killer of its ply and in the history table.
+    """
+    killers = search.killer_moves[ply]
+    if move != killers[0]:
+        killers[1] = killers[0]
+        killers[0] = move
+    key = historyKey(move)
+    search.history_scores[key] = search.history_scores.get(key, 0) + depth * depth
+
+
+class SearchTimeout(Exception):
+    """
+    Raised from inside the search when its time or node budget runs out or it is stopped.
+    """
+
 
+class SearchStats:
+    """
+    Counters of one search, cheap enough to always keep, and its principal_variation.
+    findBestMove returns them with the move.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.nodes = 0  # every node searched, quiescence nodes included
+        self.qnodes = 0  # nodes of the quiescence search
+        self.expanded_nodes = 0  # nodes whose moves were searched
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0  # beta cutoffs by the first move searched, a measure of move ordering
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.depth_times = []  # (depth, seconds since the start, nodes so far) when each depth was completed
+        self.tablebase_hits = 0  # positions inside the search scored from the tablebases
+        self.null_move_cutoffs = 0
+        self.reduced_moves = 0  # moves searched with a late-move reduction
+        self.re_searches = 0  # reduced moves that beat alpha and were searched again to full depth
+        self.aspiration_re_searches = 0  # depths searched again because the score fell outside the aspiration window
+        self.principal_variation = PrincipalVariation()
+        self.book_move = False  # the move came from the opening book, nothing was searched
+        self.tablebase_move = False  # the move came from the tablebases, nothing was searched
+
+    def completeDepth(self, depth):
+        self.depth_times.append((depth, time.time() - self.start_time, self.nodes))
+
+    def add(self, other):
+        """
+        Add the counters of a search that was part of this one, e.g. a root move searched by a worker process.
+        """
+        self.nodes += other.nodes
+        self.qnodes += other.qnodes
+        self.expanded_nodes += other.expanded_nodes
+        self.beta_cutoffs += other.beta_cutoffs
+        self.first_move_cutoffs += other.first_move_cutoffs
+        self.tt_probes += other.tt_probes
+        self.tt_hits += other.tt_hits
+        self.tablebase_hits += other.tablebase_hits
+        self.null_move_cutoffs += other.null_move_cutoffs
+        self.reduced_moves += other.reduced_moves
+        self.re_searches += other.re_searches
+        self.aspiration_re_searches += other.aspiration_re_searches
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def nodesPerSecond(self):
+        return self.nodes / max(self.elapsed(), 0.001)
+
+    def branchingFactor(self):
+        """
+        Effective branching factor: nodes searched for the last completed depth over those of the depth before.
+        """
+        if len(self.depth_times) < 2:
+            return 0.0
+        nodes = [0] + [depth_time[2] for depth_time in self.depth_times]
+        previous = nodes[-2] - nodes[-3]
+        return (nodes[-1] - nodes[-2]) / previous if previous else 0.0
+
+    def cutoffRate(self):
+        return self.beta_cutoffs / self.expanded_nodes if self.expanded_nodes else 0.0
+
+    def firstMoveCutoffRate(self):
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0
+
+    def ttHitRate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def __str__(self):
+        if self.book_move:
+            return "book move"
+        if self.tablebase_move:
+            return "tablebase move"
+        depths = " ".join("{}:{:.2f}s".format(depth, seconds) for depth, seconds, nodes in self.depth_times)
+        return ("nodes {} qnodes {} nps {:.0f} ebf {:.2f} cutoffs {:.0%} first-move cutoffs {:.0%} tt hits {:.0%} "
+                "tablebase hits {} null-move cutoffs {} reductions {} re-searches {} aspiration re-searches {} "
+                "depths {}").format(self.nodes, self.qnodes, self.nodesPerSecond(), self.branchingFactor(),
+                                    self.cutoffRate(), self.firstMoveCutoffRate(), self.ttHitRate(),
+                                    self.tablebase_hits, self.null_move_cutoffs, self.reduced_moves,
+                                    self.re_searches, self.aspiration_re_searches, depths)
 
-def findBestMove(game_state, valid_moves, return_queue):
-    global next_move
-    next_move = None
-    random.shuffle(valid_moves)
-    findMoveNegaMaxAlphaBeta(game_state, valid_moves, DEPTH, -CHECKMATE, CHECKMATE,
-                             1 if game_state.white_to_move else -1)
-    return_queue.put(next_move)
+
+class PrincipalVariation:
+    """
+    The line of best play a search found, kept in a triangular table: while the search runs lines[ply] is the best
+    line found from the node at ply, lines[0] the one from the root. moves, score and depth are those of the last
+    completed depth, moves as move codes and the score from the side to move's view.
+    """
+
+    def __init__(self):
+        self.lines = [[] for _ in range(MAX_PLY + 1)]
+        self.moves = []
+        self.score = 0
+        self.depth = 0
+        self.following = False  # the node being searched is on the moves, they are searched first there
+
+    def complete(self, depth, score):
+        self.moves = self.lines[0]
+        self.depth = depth
+        self.score = score
+
+    def bestMove(self):
+        return self.moves[0] if self.moves else None
+
+    def __str__(self):
+        return " ".join(ChessEngine.Move.fromCode(move).getUciNotation() for move in self.moves)
+
+
+class SearchContext:
+    """
+    Everything one search works with besides the position, passed down through it so that searches in different
+    threads don't share anything but a transposition table they are both given: its limits and pruning settings,
+    killer moves and history scores, and its stats with the principal variation.
+    """
+
+    def __init__(self, table, stats=None, stop=None, null_move_reduction=NULL_MOVE_REDUCTION,
+                 late_move_reduction=LATE_MOVE_REDUCTION):
+        self.transposition_table = table
+        self.stats = stats if stats is not None else SearchStats()
+        self.pv = self.stats.principal_variation
+        self.deadline = None  # time.time() by which the search has to end, None for no limit
+        self.node_limit = None
+        self.stop = stop  # function that cancels the search by returning True
+        self.null_move_reduction = null_move_reduction
+        self.late_move_reduction = late_move_reduction
+        self.killer_moves = [[None, None] for _ in range(MAX_PLY)]  # two quiet moves per ply that caused a cutoff
+        self.history_scores = {}  # historyKey(move) -> how much quiet moves like it caused beta cutoffs
+
+
+def findBestMove(game_state, valid_moves, return_queue, max_depth=DEPTH, time_limit=None, node_limit=None,
+                 stop=None, null_move_reduction=NULL_MOVE_REDUCTION, late_move_reduction=LATE_MOVE_REDUCTION,
+                 table=None, stats=None):
+    """
+    Search with iterative deepening: depth 1, 2, ... up to max_depth, or until time_limit seconds or
+    node_limit nodes are used up. The best move of every completed depth is put on the return_queue,
+    so the last move on the queue is always the best one found so far.
+    Depth 1 is always completed so there is a move to play, unless the search is cancelled:
+    stop is a function that is called every so often and ends the search at once when it returns True.
+    null_move_reduction and late_move_reduction tune the pruning of the search, 0 switches either off.
+    table is the TranspositionTable to use, the module's transposition_table by default. stats is the SearchStats
+    to count in, a new one by default, pass one to follow the search from another thread.
+    Returns the best move and the SearchStats of the search, which hold the principal variation of the last
+    completed depth. The move is None when there are no valid_moves or the search was stopped before depth 1.
+    Positions in the opening_book or the tablebases are not searched, the move from there is returned at once
+    and nothing is put on the queue.
+    The search itself works on move codes, the moves put on the queue and returned are Move objects.
+    """
+    search = SearchContext(table if table is not None else transposition_table, stats, stop, null_move_reduction,
+                           late_move_reduction)
+    stats = search.stats
+    if not valid_moves:  # checkmate or stalemate, there is nothing to search
+        return None, stats
+    book_move = findBookMove(game_state)
+    if book_move is not None:
+        stats.book_move = True
+        return book_move, stats
+    tablebase_move = findTablebaseMove(game_state)
+    if tablebase_move is not None:
+        stats.tablebase_move = True
+        return tablebase_move, stats
+    root_moves = [move.code for move in valid_moves]
+    random.shuffle(root_moves)  # moves that order equally are still tried in random order
+    search.transposition_table.newSearch()
+    start_time = time.time()
+    root_log_length = len(game_state.move_log)
+    turn_multiplier = 1 if game_state.white_to_move else -1
+    pv = search.pv
+    best_move = None
+    score = 0
+    for depth in range(1, max_depth + 1):
+        window = ASPIRATION_WINDOW
+        if depth > 1 and abs(score) < TABLEBASE_WIN:
+            alpha, beta = score - window, score + window
+        else:
+            alpha, beta = -CHECKMATE, CHECKMATE
+        try:
+            while True:
+                pv.following = True
+                score = findMoveNegaMaxAlphaBeta(game_state, root_moves, depth, alpha, beta, turn_multiplier, search)
+                if score <= alpha and alpha > -CHECKMATE:
+                    alpha = max(score - window, -CHECKMATE)
+                elif score >= beta and beta < CHECKMATE:
+                    beta = min(score + window, CHECKMATE)
+                else:
+                    break
+                window *= 2
+                stats.aspiration_re_searches += 1
+        except SearchTimeout:
+            # unwind the moves the interrupted iteration left on the board
+            while len(game_state.move_log) > root_log_length:
+                game_state.undoMove()
+            break
+        stats.completeDepth(depth)
+        if len(pv.lines[0]) < depth:  # cut short by a bound from the table, which may know how the line goes on
+            for move in pv.lines[0]:
+                game_state.makeMove(move)
+            pv.lines[0] = pv.lines[0] + getTableLine(game_state, depth - len(pv.lines[0]), search.transposition_table)
+            while len(game_state.move_log) > root_log_length:
+                game_state.undoMove()
+        pv.complete(depth, score)
+        best_move = ChessEngine.Move.fromCode(pv.bestMove())
+        return_queue.put(best_move)
+        # the moves of this iteration are now in the transposition table and the principal variation,
+        # they order the next one
+        if abs(score) >= CHECKMATE:
+            break
+        if time_limit is not None:
+            search.deadline = start_time + time_limit
+            if time.time() >= search.deadline:
+                break
+        if node_limit is not None:
+            search.node_limit = node_limit
+            if stats.nodes >= node_limit:
+                break
+    return best_move, stats
+
+
+def findBookMove(game_state):
+    """
+    A move from the opening_book for the position as a Move, None if there is no book or the position isn't in it.
+    """
+    if opening_book is None:
+        return None
+    return opening_book.pickMove(game_state)
+
+
+def findTablebaseMove(game_state):
+    """
+    The tablebase move for the position as a Move, None if there are no tablebases or they don't cover it.
+    """
+    if tablebases is None:
+        return None
+    move = tablebases.findBestMove(game_state)
+    return ChessEngine.Move.fromCode(move) if move is not None else None
+
+
+def tablebaseScore(value):
+    """
+    Search score of a tablebase value for the side to move. Wins and losses are worth more than any material,
+    and the fewer half moves to mate the more.
+    """
+    if value == 0:
+        return STALEMATE
+    score = TABLEBASE_WIN - (abs(value) - 1) * 0.01
+    return score if value > 0 else -score
 
 
-def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier):
-    global next_move
+def getTableLine(game_state, max_length, table):
+    """
+    The line of best play stored in the transposition table from this position, as move codes, by following the best
+    moves of its entries. Stops at a position without a stored move or whose move isn't legal there.
+    """
+    line = []
+    while len(line) < max_length:
+        entry = table.probe(game_state.zobrist_hash)
+        if entry is None or entry[4] is None or entry[4] not in game_state.getValidMoveCodes():
+            break
+        game_state.makeMove(entry[4])
+        line.append(entry[4])
+    for _ in line:
+        game_state.undoMove()
+    return line
+
+
+class SearchPool:
+    """
+    The worker processes of findBestMoveParallel. A pool that is kept from one search to the next keeps the
+    transposition tables of its workers warm. close() ends the processes, or use it in a with statement.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.alpha = multiprocessing.Value("d", -CHECKMATE)  # the best root score of the depth being searched
+        self.stopped = multiprocessing.Value("b", 0)  # set to cancel the running search
+        self.search_id = 0
+        self.pool = multiprocessing.Pool(self.processes, initParallelWorker, (self.alpha, self.stopped))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+
+def findBestMoveParallel(game_state, valid_moves, return_queue, max_depth=DEPTH, time_limit=None, processes=None,
+                         stop=None, null_move_reduction=NULL_MOVE_REDUCTION, late_move_reduction=LATE_MOVE_REDUCTION,
+                         pool=None):
+    """
+    findBestMove on several CPU cores: iterative deepening where every depth splits the root moves over the worker
+    processes of a SearchPool. The workers share the best root score found so far as their alpha bound, and every
+    worker keeps its own transposition table. pool is a SearchPool to search on, without one a pool of processes
+    (default all cores) is started for this search alone.
+    The best move of every completed depth is put on the return_queue as with findBestMove, stop and the reductions
+    work the same too. Returns the best move and the SearchStats of all workers together.
+    Book and tablebase moves are played without a search as in findBestMove.
+    """
+    stats = SearchStats()
+    if not valid_moves:
+        return None, stats
+    book_move = findBookMove(game_state)
+    if book_move is not None:
+        stats.book_move = True
+        return book_move, stats
+    tablebase_move = findTablebaseMove(game_state)
+    if tablebase_move is not None:
+        stats.tablebase_move = True
+        return tablebase_move, stats
+    root_moves = [move.code for move in valid_moves]
+    random.shuffle(root_moves)
+    if pool is None:
+        with SearchPool(max(1, min(processes or os.cpu_count() or 1, len(root_moves)))) as pool:
+            return searchOnPool(pool, game_state, root_moves, return_queue, max_depth, time_limit, stop,
+                                null_move_reduction, late_move_reduction, stats)
+    return searchOnPool(pool, game_state, root_moves, return_queue, max_depth, time_limit, stop, null_move_reduction,
+                        late_move_reduction, stats)
+
+
+def searchOnPool(pool, game_state, root_moves, return_queue, max_depth, time_limit, stop, null_move_reduction,
+                 late_move_reduction, stats):
+    """
+    The iterative deepening of findBestMoveParallel. stop is only called here, the workers are stopped through
+    the pool.
+    """
+    pool.search_id += 1
+    pool.stopped.value = 0
+    start_time = time.time()
+    deadline = None  # depth 1 is always completed
+    best_move = None
+    for depth in range(1, max_depth + 1):
+        pool.alpha.value = -CHECKMATE
+        tasks = [(pool.search_id, game_state, null_move_reduction, late_move_reduction, move, depth, deadline)
+                 for move in root_moves]
+        pending = pool.pool.map_async(searchRootMove, tasks, chunksize=1)
+        while not pending.ready():
+            pending.wait(0.01)
+            if stop is not None and stop():
+                pool.stopped.value = 1
+        results = pending.get()
+        for result in results:
+            stats.add(result[3])
+        if any(result[1] is None for result in results):
+            break  # the deadline or stop came before every root move was searched
+        stats.completeDepth(depth)
+        best = max((result for result in results if result[2]), key=lambda result: result[1])
+        best_move = ChessEngine.Move.fromCode(best[0])
+        stats.principal_variation = best[3].principal_variation
+        return_queue.put(best_move)
+        # the next depth hands out the best moves first, they raise the shared alpha soonest
+        results.sort(key=lambda result: (result is best, result[1]), reverse=True)
+        root_moves = [result[0] for result in results]
+        if abs(best[1]) >= CHECKMATE:
+            break
+        if time_limit is not None:
+            deadline = start_time + time_limit
+            if time.time() >= deadline:
+                break
+    return best_move, stats
+
+
+def initParallelWorker(shared_alpha, stopped):
+    """
+    Runs once in every worker process of a SearchPool.
+    """
+    global worker_alpha, worker_stopped, worker_search, worker_search_id
+    worker_alpha = shared_alpha
+    worker_stopped = stopped
+    worker_search = None
+    worker_search_id = None
+
+
+def isParallelSearchStopped():
+    """
+    The stop function of the searches in a worker process.
+    """
+    return worker_stopped.value != 0
+
+
+def searchRootMove(task):
+    """
+    Search one root move of a position to depth in a worker process, until the deadline at the latest.
+    Returns (move, score, exact, stats). exact is False if the move only proved to be no better than the shared alpha,
+    score is None if the deadline or stop came first. The principal variation in the stats starts with the move.
+    """
+    global worker_search, worker_search_id
+    search_id, game_state, null_move_reduction, late_move_reduction, move, depth, deadline = task
+    if search_id != worker_search_id:
+        # the worker's killer moves and history scores carry over from one of its root moves to the next
+        worker_search_id = search_id
+        worker_search = SearchContext(transposition_table, None, isParallelSearchStopped, null_move_reduction,
+                                      late_move_reduction)
+        transposition_table.newSearch()
+    search = worker_search
+    search.stats = stats = SearchStats()
+    search.pv = pv = stats.principal_variation
+    search.deadline = deadline
+    if worker_stopped.value:
+        return move, None, False, stats
+    turn_multiplier = 1 if game_state.white_to_move else -1
+    alpha = worker_alpha.value
+    try:
+        game_state.makeMove(move)
+        score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -CHECKMATE, -alpha, -turn_multiplier, search,
+                                          1)
+    except SearchTimeout:
+        return move, None, False, stats  # the position came with the task, no need to unwind it
+    with worker_alpha.get_lock():
+        if score > worker_alpha.value:
+            worker_alpha.value = score
+    pv.lines[0] = [move] + pv.lines[1]
+    pv.complete(depth, score)
+    return move, score, alpha == -CHECKMATE or score > alpha, stats
+
+
+def checkSearchLimits(search):
+    """
+    Count a node and raise SearchTimeout once the budget of the search is spent or it is stopped.
+    The clock and the stop function are only checked every 1024 nodes.
+    """
+    stats = search.stats
+    stats.nodes += 1
+    if search.node_limit is not None and stats.nodes >= search.node_limit:
+        raise SearchTimeout()
+    if stats.nodes & 1023 == 0:
+        if search.deadline is not None and time.time() >= search.deadline:
+            raise SearchTimeout()
+        if search.stop is not None and search.stop():
+            raise SearchTimeout()
+
+
+def generateMoves(game_state):
+    """
+    Legal move codes of the position, also sets checkmate and stalemate. The search generates all its moves here.
+    """
+    return game_state.getValidMoveCodes()
+
+
+def generateCaptures(game_state):
+    """
+    Legal captures and promotions of the position for the quiescence search.
+    """
+    return game_state.getCaptureMoveCodes()
+
+
+def evaluate(game_state):
+    """
+    Static score of the position from white's point of view. The search evaluates all its positions here.
+    """
+    return scoreBoard(game_state)
+
+
+# the functions installProfilingHook can wrap
+profiled_functions = {"generateMoves": generateMoves, "generateCaptures": generateCaptures, "evaluate": evaluate}
+
+
+def installProfilingHook(hook):
+    """
+    Route the search's move generation and evaluation through hook(name, function), which returns the function to
+    call instead, e.g. one that times or samples the calls (see TimingHook). installProfilingHook(None) undoes it.
+    Only searches in this process are affected. cProfile needs no hook, it lists these functions on their own.
+    """
+    global generateMoves, generateCaptures, evaluate
+    wrapped = {name: function if hook is None else hook(name, function)
+               for name, function in profiled_functions.items()}
+    generateMoves = wrapped["generateMoves"]
+    generateCaptures = wrapped["generateCaptures"]
+    evaluate = wrapped["evaluate"]
+
+
+class TimingHook:
+    """
+    Profiling hook that adds up the calls and seconds of every wrapped function: installProfilingHook(TimingHook()).
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+
+    def __call__(self, name, function):
+        def timedFunction(game_state):
+            start_time = time.perf_counter()
+            result = function(game_state)
+            self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - start_time
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return result
+
+        return timedFunction
+
+    def __str__(self):
+        return "  ".join("{} {} calls {:.2f}s".format(name, self.calls[name], self.seconds[name])
+                         for name in sorted(self.calls))
+
+
+def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier, search, ply=0):
+    """
+    valid_moves is a list of move codes or None, moves are then only generated if the transposition table
+    can't answer for the position. search is the SearchContext and ply the distance from the root. The best line
+    found from this node is left in search.pv.lines[ply], from the root that is the principal variation.
+    Principal variation search: after the first move the moves are only searched with a null window to prove they
+    don't beat alpha, and searched again with the whole window if one does.
+    """
+    checkSearchLimits(search)
+    stats = search.stats
+    pv = search.pv
+    table = search.transposition_table
+    pv.lines[ply] = []
+    # a position that repeats one from earlier in the game or the search is a draw, playing on can't change that.
+    # The fifty-move rule too, unless the hundredth half move gave checkmate
+    if ply != 0:
+        if game_state.halfmove_clock >= 100:
+            if game_state.inCheck() and game_state.isGameOver():
+                return turn_multiplier * evaluate(game_state)
+            return DRAW
+        if game_state.repetitionCount() or game_state.isInsufficientMaterial():
+            return DRAW
+    if tablebases is not None and ply != 0:
+        value = tablebases.probe(game_state)
+        if value is not None:
+            stats.tablebase_hits += 1
+            return tablebaseScore(value)
+    alpha_original = alpha
+    pv_node = beta - alpha > NULL_WINDOW
+    hash_move = None
+    stats.tt_probes += 1
+    entry = table.probe(game_state.zobrist_hash)
+    if entry is not None:
+        stats.tt_hits += 1
+        hash_move = entry[4]
+    if entry is not None and entry[1] >= depth and ply != 0:  # the root always searches to find its line
+        score = entry[2]
+        if entry[3] == EXACT:
+            if pv_node:  # the principal variation goes on with the line stored in the table
+                pv.lines[ply] = getTableLine(game_state, depth, table)
+            return score
+        elif entry[3] == LOWER_BOUND:
+            alpha = max(alpha, score)
+        else:
+            beta = min(beta, score)
+        if alpha >= beta:
+            return score
     if depth == 0:
-        return turn_multiplier * scoreBoard(game_state)
-    # move ordering - implement later //TODO
+        # the quiescence search stands pat without ever looking for a move, so look for a stalemate here,
+        # the first legal move found settles it. With pieces besides king and pawns one is as good as impossible
+        if not hasPieces(game_state) and game_state.isGameOver():
+            return turn_multiplier * evaluate(game_state)
+        return quiescenceSearch(game_state, alpha, beta, turn_multiplier, search)
+    # the principal variation of the previous iteration is searched first while the search is still following it
+    following = pv.following and ply < len(pv.moves)
+    pv_move = pv.moves[ply] if following else None
+    if following:
+        hash_move = pv_move
+    pv.following = False
+    in_check = game_state.inCheck()
+    # null-move pruning: pass the turn, if the opponent still can't get the score below beta a real move won't either.
+    # Not twice in a row, not in check, and not without pieces where zugzwang makes passing better than any move
+    if search.null_move_reduction and depth >= NULL_MOVE_MIN_DEPTH and ply != 0 and not in_check and \
+            beta < TABLEBASE_WIN and game_state.move_log[-1] != ChessEngine.NULL_MOVE and hasPieces(game_state) and \
+            turn_multiplier * evaluate(game_state) >= beta:
+        game_state.makeNullMove()
+        score = -findMoveNegaMaxAlphaBeta(game_state, None, max(depth - 1 - search.null_move_reduction, 0),
+                                          -beta, -beta + NULL_WINDOW, -turn_multiplier, search, ply + 1)
+        game_state.undoNullMove()
+        if score >= beta:
+            stats.null_move_cutoffs += 1
+            return beta if score >= TABLEBASE_WIN else score  # a mate found after passing proves nothing
+    if valid_moves is None:
+        moves = pickMoves(game_state, hash_move, search, ply)  # also sets checkmate and stalemate for scoreBoard
+    else:
+        orderMoves(valid_moves, hash_move, search, ply)
+        moves = valid_moves
+    stats.expanded_nodes += 1
     max_score = -CHECKMATE
-    for move in valid_moves:
+    best_move = None
+    killers = search.killer_moves[ply]
+    late_move_reduction = search.late_move_reduction
+    for move_number, move in enumerate(moves):
         game_state.makeMove(move)
-        next_moves = game_state.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(game_state, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
-        if score > max_score:
-            max_score = score
-            if depth == DEPTH:
-                next_move = move
-            print(move, score, depth)
+        pv.following = following and move == pv_move
+        if move_number == 0:
+            score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier, search,
+                                              ply + 1)
+        else:
+            # late-move reductions: a quiet move ordered this late rarely beats alpha, prove that with a shallower
+            # search first
+            reduced = late_move_reduction and depth >= LATE_MOVE_MIN_DEPTH and \
+                move_number >= LATE_MOVE_MIN_NUMBER and not in_check and \
+                not move >> ChessEngine.PIECE_CAPTURED_SHIFT and not move & ChessEngine.PROMOTION_FLAG and \
+                move != killers[0] and move != killers[1] and not game_state.inCheck()
+            if reduced:
+                stats.reduced_moves += 1
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, max(depth - 1 - late_move_reduction, 0),
+                                                  -alpha - NULL_WINDOW, -alpha, -turn_multiplier, search, ply + 1)
+                if score > alpha:
+                    stats.re_searches += 1
+            if not reduced or score > alpha:
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -alpha - NULL_WINDOW, -alpha,
+                                                  -turn_multiplier, search, ply + 1)
+            if alpha < score < beta:
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier,
+                                                  search, ply + 1)
         game_state.undoMove()
+        if score > max_score or best_move is None:  # all moves may lose to the same mate
+            max_score = score
+            best_move = move
+            if score > alpha or ply == 0:  # the root has a line even when every move fails low
+                pv.lines[ply] = [move] + pv.lines[ply + 1]
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
+            stats.beta_cutoffs += 1
+            if move_number == 0:
+                stats.first_move_cutoffs += 1
+            if not move >> ChessEngine.PIECE_CAPTURED_SHIFT:  # quiet move
+                storeQuietCutoff(move, depth, search, ply)
             break
+    if game_state.checkmate or game_state.stalemate:  # set by pickMoves when there were no moves
+        return turn_multiplier * evaluate(game_state)
+    if max_score <= alpha_original:
+        bound = UPPER_BOUND
+    elif max_score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    table.store(game_state.zobrist_hash, depth, max_score, bound, best_move)
+    if pv_node and not pv.lines[ply]:  # a bound from the table kept every move from beating alpha
+        pv.lines[ply] = getTableLine(game_state, depth, table)
+    return max_score
+
+
+def hasPieces(game_state):
+    """
+    Whether the side to move has anything besides its king and pawns.
+    """
+    color = "w" if game_state.white_to_move else "b"
+    bitboards = game_state.bitboards
+    return game_state.occupancy[color] != bitboards[color + "p"] | bitboards[color + "K"]
+
+
+def quiescenceSearch(game_state, alpha, beta, turn_multiplier, search):
+    """
+    Search only captures and promotions past the horizon until the position is quiet, so that the score is never
+    taken in the middle of an exchange. The side to move may stand pat on the static score instead of capturing,
+    except when it is in check, then every way out of check is searched.
+    """
+    checkSearchLimits(search)
+    search.stats.qnodes += 1
+    if game_state.isInsufficientMaterial():  # e.g. after the last pawn was taken
+        return DRAW
+    in_check = game_state.inCheck()
+    if in_check:
+        moves = generateMoves(game_state)  # also sets checkmate for scoreBoard
+        if len(moves) == 0:
+            return turn_multiplier * evaluate(game_state)
+        max_score = -CHECKMATE
+    else:
+        max_score = turn_multiplier * evaluate(game_state)  # stand pat
+        if max_score >= beta:
+            return max_score
+        moves = generateCaptures(game_state)
+    stand_pat = max_score
+    if max_score > alpha:
+        alpha = max_score
+    moves.sort(key=mvvLvaScore, reverse=True)
+    for move in moves:
+        # delta pruning: even winning the captured piece for free leaves the score too far below alpha
+        if not in_check and not move & ChessEngine.PROMOTION_FLAG and stand_pat + DELTA_MARGIN + \
+                mvv_lva_piece_values[move >> ChessEngine.PIECE_CAPTURED_SHIFT] <= alpha:
+            continue
+        game_state.makeMove(move)
+        score = -quiescenceSearch(game_state, -beta, -alpha, -turn_multiplier, search)
+        game_state.undoMove()
+        if score > max_score:
+            max_score = score
+            if max_score > alpha:
+                alpha = max_score
+                if alpha >= beta:
+                    break
     return max_score
 
 
@@ -106,21 +886,7 @@ def scoreBoard(game_state):
             return CHECKMATE  # white wins
     elif game_state.stalemate:
         return STALEMATE
-    score = 0
-
-    for row in range(len(game_state.board)):
-        for col in range(len(game_state.board[row])):
-            piece = game_state.board[row][col]
-            if piece != "--":
-                piece_position_score = 0
-                if piece[1] != "K":
-                    piece_position_score = piece_position_scores[piece][row][col]
-                if piece[0] == "w":
-                    score += piece_score[piece[1]] + piece_position_score
-                if piece[0] == "b":
-                    score -= piece_score[piece[1]] + piece_position_score
-
-    return score
+    return game_state.score  # material and piece positions, kept up to date by makeMove and undoMove
 
 
 def findRandomMove(valid_moves):
@@ -0,0 +1,113 @@
+# Encodes and evaluates many positions at once with NumPy, for scoring large sets of positions offline
+# (analysis, tuning) where evaluating one GameState at a time is far too slow. Needs numpy, the game doesn't.
+#   boards = ChessBatch.encodeFens(fens)          or ChessBatch.encodeGameStates(game_states)
+#   scores = ChessBatch.evaluateBoards(boards)    the same scores as GameState.score, in pawns from white's view
+#   planes = ChessBatch.boardsToPlanes(boards)    12 planes of 8x8 per position, one for each piece
+# A board is a row of 64 piece indices in the order of GameState.board, a8 first: 0 for an empty square, otherwise
+# the index of the piece in ChessEngine.MOVE_PIECES. Or score a file with one FEN per line from this directory:
+#   python ChessBatch.py positions.txt -o scores.npy
+import argparse
+import time
+import numpy as np
+import ChessEngine
+import ChessEvaluation
+
+PIECES = ChessEngine.MOVE_PIECES[1:]  # by plane, a board holds the plane + 1
+# the value of every piece index on every square, row 0 for the empty squares
+PIECE_SQUARE_TABLE = np.array([[0.0] * 64] + [ChessEvaluation.piece_square_values[piece] for piece in PIECES])
+SQUARES = np.arange(64)
+
+# the piece index of every character of a FEN's piece placement once its digits are spelled out as empty squares
+FEN_INDEX = np.full(256, -1, dtype=np.int8)
+FEN_INDEX[ord(".")] = 0
+for _letter, _piece in ChessEngine.FEN_PIECES.items():
+    FEN_INDEX[ord(_letter)] = PIECES.index(_piece) + 1
+# a spelled out placement and its line end: 8 ranks of 8 squares, each followed by "/" and the last one by "\n"
+PLACEMENT_LENGTH = 72
+SEPARATOR_COLUMNS = np.arange(8, PLACEMENT_LENGTH, 9)
+SEPARATORS = np.frombuffer(b"///////\n", dtype=np.uint8)
+SQUARE_COLUMNS = np.delete(np.arange(PLACEMENT_LENGTH), SEPARATOR_COLUMNS)
+
+
+def spellOut(placements):
+    """
+    FEN piece placements with the digits spelled out as that many empty squares (".").
+    """
+    for count in range(1, 9):
+        placements = placements.replace(str(count), "." * count)
+    return placements
+
+
+def hasEightByEight(fen):
+    """
+    Whether the piece placement of a FEN has 8 ranks of 8 squares each.
+    """
+    return [len(rank) for rank in spellOut(fen.split(" ", 1)[0]).split("/")] == [8] * 8
+
+
+def encodeFens(fens):
+    """
+    Boards of FENs as an array of shape (n, 64). Only the piece placement is read. The placements of all FENs are
+    spelled out together, one per line, and looked up in one go. Raises ValueError for the first FEN with a rank
+    that isn't 8 squares, fewer or more than 8 ranks, or a character that isn't a piece.
+    """
+    text = spellOut("".join(fen.split(" ", 1)[0] + "\n" for fen in fens))
+    characters = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8)
+    # every rank has to come out as 8 squares, so the separators line up
+    if len(characters) != PLACEMENT_LENGTH * len(fens) or \
+            (characters.reshape(-1, PLACEMENT_LENGTH)[:, SEPARATOR_COLUMNS] != SEPARATORS).any():
+        raise ValueError("Invalid FEN: " + next(fen for fen in fens if not hasEightByEight(fen)))
+    boards = FEN_INDEX[characters.reshape(-1, PLACEMENT_LENGTH)[:, SQUARE_COLUMNS]]
+    if (boards < 0).any():
+        raise ValueError("Invalid FEN: " + fens[int(np.nonzero((boards < 0).any(axis=1))[0][0])])
+    return boards
+
+
+def encodeGameStates(game_states):
+    """
+    Boards of GameStates as an array of shape (n, 64), from their bitboards. The bits of all of them are unpacked
+    together.
+    """
+    bitboards = np.array([[game_state.bitboards[piece] for piece in PIECES] for game_state in game_states],
+                         dtype="<u8").reshape(-1, len(PIECES))
+    bits = np.unpackbits(bitboards.view(np.uint8), bitorder="little").reshape(-1, len(PIECES), 64)
+    return (bits * np.arange(1, len(PIECES) + 1, dtype=np.int8)[:, np.newaxis]).sum(axis=1, dtype=np.int8)
+
+
+def boardsToPlanes(boards):
+    """
+    Boards as an array of shape (n, 12, 8, 8) with a 1 where the plane's piece stands. The planes are in the order
+    of PIECES and their rows and columns those of GameState.board.
+    """
+    planes = boards[:, np.newaxis, :] == np.arange(1, len(PIECES) + 1)[:, np.newaxis]
+    return planes.astype(np.uint8).reshape(-1, len(PIECES), 8, 8)
+
+
+def evaluateBoards(boards):
+    """
+    Material and piece-square score of every board, positive is good for white, as GameState.score and scoreBoard
+    give it for one position. Checkmate and stalemate aren't looked for.
+    """
+    return PIECE_SQUARE_TABLE[boards, SQUARES].sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a file of FENs, one per line, with the static evaluation.")
+    parser.add_argument("fens", help="file with one FEN per line, blank lines and lines starting with # are skipped")
+    parser.add_argument("-o", "--output", help="save the scores to this .npy file instead of printing them")
+    args = parser.parse_args()
+    with open(args.fens) as file:
+        fens = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+    start_time = time.time()
+    scores = evaluateBoards(encodeFens(fens))
+    seconds = time.time() - start_time
+    if args.output:
+        np.save(args.output, scores)
+    else:
+        for fen, score in zip(fens, scores):
+            print("{:.2f}  {}".format(score, fen))
+    print("{} positions in {:.2f}s".format(len(fens), seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Bitboard helpers and precomputed attack tables.
+# A bitboard is a 64-bit integer with one bit per square.
+# Squares are indexed as row * 8 + col, so bit 0 is a8 and bit 63 is h1, the same layout as GameState.board.
+
+FULL = (1 << 64) - 1
+FILE_A = 0x0101010101010101  # col 0
+FILE_H = FILE_A << 7  # col 7
+LIGHT_SQUARES = sum(1 << square for square in range(64) if ((square >> 3) + (square & 7)) % 2 == 0)  # a8 is light
+DARK_SQUARES = FULL ^ LIGHT_SQUARES
+
+# (row, col) steps of the rook and bishop lines, and all eight of them for the king
+ORTHOGONAL_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+DIAGONAL_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+DIRECTIONS = ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+
+
+def squareBit(row, col):
+    return 1 << (row * 8 + col)
+
+
+def lowestSquare(bitboard):
+    """
+    Index of the least significant set bit.
+    """
+    return (bitboard & -bitboard).bit_length() - 1
+
+
+def highestSquare(bitboard):
+    """
+    Index of the most significant set bit.
+    """
+    return bitboard.bit_length() - 1
+
+
+def squares(bitboard):
+    """
+    List the indexes of all set bits, lowest first.
+    """
+    result = []
+    while bitboard:
+        lsb = bitboard & -bitboard
+        result.append(lsb.bit_length() - 1)
+        bitboard ^= lsb
+    return result
+
+
+def popCount(bitboard):
+    return bin(bitboard).count("1")
+
+
+def _stepTable(steps):
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        attacks = 0
+        for d_row, d_col in steps:
+            end_row = row + d_row
+            end_col = col + d_col
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                attacks |= squareBit(end_row, end_col)
+        table.append(attacks)
+    return table
+
+
+def _rayTable(direction):
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        ray = 0
+        for i in range(1, 8):
+            end_row = row + direction[0] * i
+            end_col = col + direction[1] * i
+            if not (0 <= end_row <= 7 and 0 <= end_col <= 7):
+                break
+            ray |= squareBit(end_row, end_col)
+        table.append(ray)
+    return table
+
+
+KNIGHT_ATTACKS = _stepTable(KNIGHT_STEPS)
+KING_ATTACKS = _stepTable(DIRECTIONS)
+# squares attacked by a pawn of the given color standing on the square
+PAWN_ATTACKS = {"w": _stepTable(((-1, -1), (-1, 1))), "b": _stepTable(((1, -1), (1, 1)))}
+
+# RAYS[direction][square] - every square from square (exclusive) to the edge of the board in that direction
+RAYS = {direction: _rayTable(direction) for direction in DIRECTIONS}
+# directions that walk towards higher square indexes find their nearest blocker at the lowest set bit
+POSITIVE_DIRECTIONS = frozenset(direction for direction in DIRECTIONS if direction[0] * 8 + direction[1] > 0)
+
+# LINES[direction][square] - the full line through square along direction, excluding the square itself
+LINES = {direction: [RAYS[direction][square] | RAYS[(-direction[0], -direction[1])][square] for square in range(64)]
+         for direction in DIRECTIONS}
+
+
+def rayAttacks(square, occupied, direction):
+    """
+    Squares attacked from square along direction, up to and including the first occupied square.
+    """
+    ray = RAYS[direction][square]
+    blockers = ray & occupied
+    if blockers:
+        if direction in POSITIVE_DIRECTIONS:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        ray ^= RAYS[direction][blocker]
+    return ray
+
+
+def rookAttacks(square, occupied):
+    return (rayAttacks(square, occupied, (-1, 0)) | rayAttacks(square, occupied, (0, -1)) |
+            rayAttacks(square, occupied, (1, 0)) | rayAttacks(square, occupied, (0, 1)))
+
+
+def bishopAttacks(square, occupied):
+    return (rayAttacks(square, occupied, (-1, -1)) | rayAttacks(square, occupied, (-1, 1)) |
+            rayAttacks(square, occupied, (1, -1)) | rayAttacks(square, occupied, (1, 1)))
+
+
+def queenAttacks(square, occupied):
+    return rookAttacks(square, occupied) | bishopAttacks(square, occupied)
+
+
+def pawnAttacks(pawns, color):
+    """
+    Squares attacked by all the pawns of color ("w" or "b") in the pawns bitboard at once.
+    """
+    if color == "w":  # white pawns attack towards row 0
+        return (pawns & ~FILE_A) >> 9 | (pawns & ~FILE_H) >> 7
+    return ((pawns & ~FILE_A) << 7 | (pawns & ~FILE_H) << 9) & FULL
@@ -0,0 +1,108 @@
+# Opening books in the Polyglot format, the .bin books most engines and GUIs use.
+# A book is a file of 16-byte entries sorted by position key: key (8 bytes), move (2), weight (2) and learn (4),
+# all big-endian. The file is memory-mapped and binary searched, never read into memory, so any number of
+# engine processes can use one large book and share its pages through the operating system.
+import mmap
+import random
+import struct
+import ChessEngine
+
+ENTRY_SIZE = 16
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+PROMOTION_PIECES = ("", "N", "B", "R", "Q")  # by the promotion field of a book move
+
+
+def polyglotKey(game_state):
+    """
+    The Polyglot key of the position. It is the Zobrist hash of the GameState, except that Polyglot only counts
+    the en-passant file when a pawn of the side to move can actually capture en passant.
+    """
+    key = game_state.zobrist_hash
+    if game_state.enpassant_possible != ():
+        row, col = game_state.enpassant_possible
+        if game_state.white_to_move:
+            pawn, pawn_row = "wp", row + 1  # the capturing pawns stand beside the pawn that just moved
+        else:
+            pawn, pawn_row = "bp", row - 1
+        if not any(0 <= pawn_col <= 7 and game_state.board[pawn_row][pawn_col] == pawn
+                   for pawn_col in (col - 1, col + 1)):
+            key ^= ChessEngine.ZOBRIST_ENPASSANT_KEYS[col]
+    return key
+
+
+def getMoveId(book_move, board):
+    """
+    The Move.moveID of a book move on the board. Polyglot writes castling as the king taking its own rook.
+    """
+    end_square = (7 - (book_move >> 3 & 7)) * 8 + (book_move & 7)  # book squares count ranks from rank 1
+    start_square = (7 - (book_move >> 9 & 7)) * 8 + (book_move >> 6 & 7)
+    piece = board[start_square >> 3][start_square & 7]
+    if piece[1] == "K" and board[end_square >> 3][end_square & 7] == piece[0] + "R":
+        end_square = start_square + (2 if end_square > start_square else -2)
+    promotion = PROMOTION_PIECES[book_move >> 12 & 7]
+    promotion_index = ChessEngine.Move.promotion_pieces.index(promotion) if promotion else 0
+    return start_square | end_square << 6 | promotion_index << ChessEngine.PROMOTION_SHIFT
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entry_count = len(self.data) // ENTRY_SIZE
+
+    def __getstate__(self):
+        return self.path  # a mapping can't be pickled, another process maps the file itself
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def findEntries(self, key):
+        """
+        All (move, weight) entries of the book for the position key, by binary search for the first one.
+        """
+        low, high = 0, self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY_SIZE)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for index in range(low, self.entry_count):
+            entry_key, move, weight, learn = ENTRY.unpack_from(self.data, index * ENTRY_SIZE)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+        return entries
+
+    def getMoves(self, game_state):
+        """
+        The book moves of the position as (move code, weight), leaving out any that aren't legal in it.
+        """
+        valid_moves = {move & ChessEngine.MOVE_ID_MASK: move for move in game_state.getValidMoveCodes()}
+        moves = []
+        for book_move, weight in self.findEntries(polyglotKey(game_state)):
+            move = valid_moves.get(getMoveId(book_move, game_state.board))
+            if move is not None:
+                moves.append((move, weight))
+        return moves
+
+    def pickMove(self, game_state, rng=random):
+        """
+        A book move for the position as a Move, chosen at random in proportion to the weights, or None when the
+        position isn't in the book. Moves with weight 0 are never played.
+        """
+        moves = [(move, weight) for move, weight in self.getMoves(game_state) if weight > 0]
+        if not moves:
+            return None
+        pick = rng.randrange(sum(weight for move, weight in moves))
+        for move, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return ChessEngine.Move.fromCode(move)
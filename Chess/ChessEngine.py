@@ -1,10 +1,55 @@
 # Storing all the information about the current state of chess game.
 # Determining valid moves at current state.
 # It will keep move log.
+import ChessBitboard
+import ChessEvaluation
+import ChessZobrist
+
+# Zobrist hashing keys: one random 64-bit number per piece on each square, per castling right,
+# per en-passant file and for the side to move, taken from the Polyglot Random64 table (see ChessZobrist).
+ZOBRIST_KEYS = ChessZobrist.RANDOM64
+POLYGLOT_PIECES = ("bp", "wp", "bN", "wN", "bB", "wB", "bR", "wR", "bQ", "wQ", "bK", "wK")
+# ZOBRIST_PIECE_KEYS[piece][square] uses the row * 8 + col square index, Polyglot counts ranks from rank 1
+ZOBRIST_PIECE_KEYS = {piece: [ZOBRIST_KEYS[64 * kind + 8 * (7 - square // 8) + square % 8] for square in range(64)]
+                      for kind, piece in enumerate(POLYGLOT_PIECES)}
+ZOBRIST_CASTLING_KEYS = ZOBRIST_KEYS[768:772]  # white king-side, white queen-side, black king-side, black queen-side
+ZOBRIST_ENPASSANT_KEYS = ZOBRIST_KEYS[772:780]  # indexed by the file (col) of the en-passant square
+ZOBRIST_TURN_KEY = ZOBRIST_KEYS[780]  # included while white is to move
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+# FEN piece letters: white pieces are upper case, black pieces lower case
+FEN_PIECES = {"P": "wp", "R": "wR", "N": "wN", "B": "wB", "Q": "wQ", "K": "wK",
+              "p": "bp", "r": "bR", "n": "bN", "b": "bB", "q": "bQ", "k": "bK"}
+PIECES_TO_FEN = {v: k for k, v in FEN_PIECES.items()}
+
+# Moves are packed into integers, which is what the move generators, the move log and the search work with.
+# bits 0-5: start square, bits 6-11: end square (row * 8 + col), bits 12-13: promotion piece (Move.promotion_pieces),
+# bits 14-16: flags, bits 17-20: piece moved, bits 21-24: piece captured (indexes into MOVE_PIECES, 0 for none).
+# Move objects decode a code for everything that wants readable attributes.
+MOVE_PIECES = ("--", "wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")
+MOVE_PIECE_INDEX = {piece: index for index, piece in enumerate(MOVE_PIECES)}
+PROMOTION_SHIFT = 12
+PROMOTION_FLAG = 1 << 14
+ENPASSANT_FLAG = 1 << 15
+CASTLE_FLAG = 1 << 16
+PIECE_MOVED_SHIFT = 17
+PIECE_CAPTURED_SHIFT = 21  # the highest field, so a move is a capture when code >> PIECE_CAPTURED_SHIFT is not 0
+MOVE_ID_MASK = (1 << 14) - 1  # start, end and promotion piece are enough to tell the moves of a position apart
+NULL_MOVE = 0  # logged by makeNullMove, no real move has the same start and end square
+PIECE_MOVED_BITS = {piece: index << PIECE_MOVED_SHIFT for piece, index in MOVE_PIECE_INDEX.items()}
+PIECE_CAPTURED_BITS = {piece: index << PIECE_CAPTURED_SHIFT for piece, index in MOVE_PIECE_INDEX.items()}
+
+
+def encodeMove(start_row, start_col, end_row, end_col, piece_moved, piece_captured, flags=0, promotion_index=0):
+    """
+    Pack a move into its integer code, flags are PROMOTION_FLAG, ENPASSANT_FLAG and CASTLE_FLAG.
+    """
+    return (start_row * 8 + start_col | (end_row * 8 + end_col) << 6 | promotion_index << PROMOTION_SHIFT | flags |
+            PIECE_MOVED_BITS[piece_moved] | PIECE_CAPTURED_BITS[piece_captured])
 
 
 class GameState:
-    def __init__(self):
+    def __init__(self, fen=None):
         # Board is an 8x8 2d list, each element in list has 2 characters.
         # The first character represents the color of the piece: 'b' or 'w'.
         # The second character represents the type of the piece: 'R', 'N', 'B', 'Q', 'K' or 'p'.
@@ -28,146 +73,539 @@ class GameState:
         self.checkmate = False
         self.stalemate = False
         self.in_check = False
-        self.pins = []
+        self.pins = {}
         self.checks = []
+        self.check_mask = ChessBitboard.FULL
+        self.enemy_attacks = 0
         self.enpassant_possible = ()  # coordinates for the square where en-passant capture is possible
         self.enpassant_possible_log = [self.enpassant_possible]
         self.current_castling_rights = CastleRights(True, True, True, True)
         self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                                self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        # Bitboards mirror the board for move generation: one 64-bit integer per piece ("wp", "bK", ...)
+        # and one occupancy mask per color ("w", "b"). See ChessBitboard for the square layout.
+        self.bitboards = {}
+        self.occupancy = {}
+        self.syncBitboards()
+        self.zobrist_hash = self.computeZobristHash()  # kept up to date incrementally by makeMove/undoMove
+        self.zobrist_hash_log = [self.zobrist_hash]
+        self.halfmove_clock = 0  # half moves since the last capture or pawn move
+        self.halfmove_clock_log = [self.halfmove_clock]
+        self.fullmove_number = 1  # starts at 1 and goes up after every black move
+        # material and piece-square score from white's point of view (see ChessEvaluation.piece_square_values)
+        self.score = self.computeScore()
+        self.score_log = [self.score]
+        if fen is not None:
+            self.loadFen(fen)
+
+    def setPosition(self, board, white_to_move=True, castling_rights=None, enpassant_possible=(), halfmove_clock=0,
+                    fullmove_number=1):
+        """
+        Set up any position and start a new move log from it.
+        board has the same layout as self.board, castling_rights is a CastleRights (default: no castling)
+        and enpassant_possible the (row, col) of the en-passant square or ().
+        Raises ValueError unless each side has exactly one king, for a pawn on the first or last rank and when the
+        side not to move is in check. Castling rights whose king or rook isn't on its
+        home square are dropped, and so is an en-passant square no pawn can just have passed.
+        """
+        pieces = [piece for row in board for piece in row]
+        if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError("Each side needs exactly one king")
+        if any(piece[1] == "p" for piece in board[0] + board[7]):
+            raise ValueError("Pawns can't stand on the first or last rank")
+        self.board = [list(row) for row in board]
+        self.white_to_move = white_to_move
+        self.move_log = []
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col] == "wK":
+                    self.white_king_location = (row, col)
+                elif self.board[row][col] == "bK":
+                    self.black_king_location = (row, col)
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+        self.pins = {}
+        self.checks = []
+        self.check_mask = ChessBitboard.FULL
+        self.enemy_attacks = 0
+        if enpassant_possible != ():
+            # the pawn that just moved two squares stands in front of the square, the squares it crossed are empty
+            row, col = enpassant_possible
+            step = 1 if white_to_move else -1
+            if row != (2 if white_to_move else 5) or self.board[row + step][col] != ("bp" if white_to_move else "wp") \
+                    or self.board[row][col] != "--" or self.board[row - step][col] != "--":
+                enpassant_possible = ()
+        self.enpassant_possible = enpassant_possible
+        self.enpassant_possible_log = [self.enpassant_possible]
+        if castling_rights is None:
+            castling_rights = CastleRights(False, False, False, False)
+        white_king_home = self.board[7][4] == "wK"
+        black_king_home = self.board[0][4] == "bK"
+        castling_rights = CastleRights(castling_rights.wks and white_king_home and self.board[7][7] == "wR",
+                                       castling_rights.bks and black_king_home and self.board[0][7] == "bR",
+                                       castling_rights.wqs and white_king_home and self.board[7][0] == "wR",
+                                       castling_rights.bqs and black_king_home and self.board[0][0] == "bR")
+        self.current_castling_rights = CastleRights(castling_rights.wks, castling_rights.bks,
+                                                    castling_rights.wqs, castling_rights.bqs)
+        self.castle_rights_log = [CastleRights(castling_rights.wks, castling_rights.bks,
+                                               castling_rights.wqs, castling_rights.bqs)]
+        self.syncBitboards()
+        king_row, king_col = self.black_king_location if white_to_move else self.white_king_location
+        if self.isSquareAttacked(king_row, king_col, "w" if white_to_move else "b"):
+            raise ValueError("The side not to move is in check")
+        self.zobrist_hash = self.computeZobristHash()
+        self.zobrist_hash_log = [self.zobrist_hash]
+        self.halfmove_clock = halfmove_clock
+        self.halfmove_clock_log = [self.halfmove_clock]
+        self.fullmove_number = fullmove_number
+        self.score = self.computeScore()
+        self.score_log = [self.score]
+
+    def loadFen(self, fen):
+        """
+        Set up the position described by a FEN string, e.g. START_FEN.
+        The move counters may be left out, they then default to 0 and 1.
+        Raises ValueError for a FEN that can't be read or a position setPosition refuses.
+        """
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError("FEN needs 4 or 6 fields: " + fen)
+        placement, turn, castling, enpassant = fields[:4]
+        board = []
+        for rank in placement.split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char in FEN_PIECES:
+                    row.append(FEN_PIECES[char])
+                else:
+                    raise ValueError("Invalid piece '" + char + "' in FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("Every rank needs 8 squares in FEN: " + fen)
+            board.append(row)
+        if len(board) != 8:
+            raise ValueError("FEN needs 8 ranks: " + fen)
+        if turn not in ("w", "b"):
+            raise ValueError("Side to move must be 'w' or 'b' in FEN: " + fen)
+        if castling != "-" and not set(castling) <= set("KQkq"):
+            raise ValueError("Invalid castling rights in FEN: " + fen)
+        castling_rights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        if enpassant == "-":
+            enpassant_possible = ()
+        elif len(enpassant) == 2 and enpassant[0] in Move.files_to_cols and \
+                enpassant[1] == ("6" if turn == "w" else "3"):  # behind a pawn the other side just moved
+            enpassant_possible = (Move.ranks_to_rows[enpassant[1]], Move.files_to_cols[enpassant[0]])
+        else:
+            raise ValueError("Invalid en-passant square in FEN: " + fen)
+        halfmove_clock, fullmove_number = 0, 1
+        if len(fields) == 6:
+            if not (fields[4].isdigit() and fields[5].isdigit()):
+                raise ValueError("Move counters must be numbers in FEN: " + fen)
+            halfmove_clock, fullmove_number = int(fields[4]), int(fields[5])
+        try:
+            self.setPosition(board, turn == "w", castling_rights, enpassant_possible, halfmove_clock,
+                             fullmove_number)
+        except ValueError as error:
+            raise ValueError("{} in FEN: {}".format(error, fen)) from None
+
+    def getFen(self):
+        """
+        FEN string of the current position.
+        """
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += PIECES_TO_FEN[piece]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.current_castling_rights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + \
+                   ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if self.enpassant_possible != ():
+            enpassant = Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+        else:
+            enpassant = "-"
+        return " ".join(("/".join(ranks), "w" if self.white_to_move else "b", castling or "-", enpassant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def getSanNotation(self, move):
+        """
+        Standard algebraic notation of a legal Move or move code in the current position, as written in PGN.
+        """
+        move = Move.fromCode(move) if type(move) is int else move
+        if move.is_castle_move:
+            notation = "O-O" if move.end_col == 6 else "O-O-O"
+        elif move.piece_moved[1] == "p":
+            notation = Move.cols_to_files[move.start_col] + "x" if move.is_capture else ""
+            notation += move.getRankFile(move.end_row, move.end_col)
+            if move.is_pawn_promotion:
+                notation += "=" + move.promotion_piece
+        else:
+            # name the start file, rank or both if another piece of the same kind can go to the same square
+            others = [other for other in self.getValidMoves() if other.piece_moved == move.piece_moved and
+                      (other.end_row, other.end_col) == (move.end_row, move.end_col) and other != move]
+            notation = move.piece_moved[1]
+            if others:
+                if all(other.start_col != move.start_col for other in others):
+                    notation += Move.cols_to_files[move.start_col]
+                elif all(other.start_row != move.start_row for other in others):
+                    notation += Move.rows_to_ranks[move.start_row]
+                else:
+                    notation += move.getRankFile(move.start_row, move.start_col)
+            if move.is_capture:
+                notation += "x"
+            notation += move.getRankFile(move.end_row, move.end_col)
+        self.makeMove(move)
+        if self.inCheck():
+            notation += "#" if len(self.getValidMoveCodes()) == 0 else "+"
+        self.undoMove()
+        return notation
+
+    def computeZobristHash(self):
+        """
+        Hash the current position from scratch.
+        """
+        zobrist_hash = ZOBRIST_TURN_KEY if self.white_to_move else 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    zobrist_hash ^= ZOBRIST_PIECE_KEYS[piece][row * 8 + col]
+        zobrist_hash ^= self.current_castling_rights.zobristKey()
+        if self.enpassant_possible != ():
+            zobrist_hash ^= ZOBRIST_ENPASSANT_KEYS[self.enpassant_possible[1]]
+        return zobrist_hash
+
+    def updateZobristHash(self, move, previous_castling_key, previous_enpassant):
+        """
+        Hash the position reached by a move code that was just made from the hash of the position before it.
+        """
+        zobrist_hash = self.zobrist_hash ^ ZOBRIST_TURN_KEY
+        start_square = move & 63
+        end_square = (move >> 6) & 63
+        piece_moved = MOVE_PIECES[(move >> PIECE_MOVED_SHIFT) & 15]
+        piece_captured = MOVE_PIECES[move >> PIECE_CAPTURED_SHIFT]
+        zobrist_hash ^= ZOBRIST_PIECE_KEYS[piece_moved][start_square]
+        zobrist_hash ^= ZOBRIST_PIECE_KEYS[self.board[end_square >> 3][end_square & 7]][end_square]  # promoted piece
+        if piece_captured != "--":
+            if move & ENPASSANT_FLAG:
+                zobrist_hash ^= ZOBRIST_PIECE_KEYS[piece_captured][(start_square & 56) | (end_square & 7)]
+            else:
+                zobrist_hash ^= ZOBRIST_PIECE_KEYS[piece_captured][end_square]
+        if move & CASTLE_FLAG:
+            rook = piece_moved[0] + "R"
+            if end_square - start_square == 2:  # king-side
+                zobrist_hash ^= ZOBRIST_PIECE_KEYS[rook][end_square + 1] ^ ZOBRIST_PIECE_KEYS[rook][end_square - 1]
+            else:  # queen-side
+                zobrist_hash ^= ZOBRIST_PIECE_KEYS[rook][end_square - 2] ^ ZOBRIST_PIECE_KEYS[rook][end_square + 1]
+        zobrist_hash ^= previous_castling_key ^ self.current_castling_rights.zobristKey()
+        if previous_enpassant != ():
+            zobrist_hash ^= ZOBRIST_ENPASSANT_KEYS[previous_enpassant[1]]
+        if self.enpassant_possible != ():
+            zobrist_hash ^= ZOBRIST_ENPASSANT_KEYS[self.enpassant_possible[1]]
+        self.zobrist_hash = zobrist_hash
+        self.zobrist_hash_log.append(zobrist_hash)
+
+    def computeScore(self):
+        """
+        Sum the piece-square values of all pieces from scratch.
+        """
+        score = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    score += ChessEvaluation.piece_square_values[piece][row * 8 + col]
+        return score
+
+    def updateScore(self, move):
+        """
+        Add the change in score of a move code that was just made.
+        """
+        values = ChessEvaluation.piece_square_values
+        start_square = move & 63
+        end_square = (move >> 6) & 63
+        piece_moved = MOVE_PIECES[(move >> PIECE_MOVED_SHIFT) & 15]
+        piece_captured = MOVE_PIECES[move >> PIECE_CAPTURED_SHIFT]
+        score = self.score - values[piece_moved][start_square]
+        score += values[self.board[end_square >> 3][end_square & 7]][end_square]  # promoted piece, if any
+        if piece_captured != "--":
+            if move & ENPASSANT_FLAG:
+                score -= values[piece_captured][(start_square & 56) | (end_square & 7)]
+            else:
+                score -= values[piece_captured][end_square]
+        if move & CASTLE_FLAG:
+            rook = piece_moved[0] + "R"
+            if end_square - start_square == 2:  # king-side
+                score += values[rook][end_square - 1] - values[rook][end_square + 1]
+            else:  # queen-side
+                score += values[rook][end_square + 1] - values[rook][end_square - 2]
+        self.score = score
+        self.score_log.append(score)
+
+    def syncBitboards(self):
+        """
+        Rebuild the bitboards from the board. Needed only after the board is changed directly.
+        """
+        self.bitboards = {color + piece: 0 for color in "wb" for piece in "pRNBQK"}
+        self.occupancy = {"w": 0, "b": 0}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    self.bitboards[piece] |= ChessBitboard.squareBit(row, col)
+                    self.occupancy[piece[0]] |= ChessBitboard.squareBit(row, col)
+
+    def updateBitboards(self, move):
+        """
+        Toggle the bits changed by the move code.
+        Toggling twice restores the bitboards, so this is called by both makeMove and undoMove.
+        """
+        start_square = move & 63
+        end_square = (move >> 6) & 63
+        start_bit = 1 << start_square
+        end_bit = 1 << end_square
+        piece_moved = MOVE_PIECES[(move >> PIECE_MOVED_SHIFT) & 15]
+        piece_captured = MOVE_PIECES[move >> PIECE_CAPTURED_SHIFT]
+        color = piece_moved[0]
+        self.bitboards[piece_moved] ^= start_bit
+        if move & PROMOTION_FLAG:
+            self.bitboards[color + Move.promotion_pieces[(move >> PROMOTION_SHIFT) & 3]] ^= end_bit
+        else:
+            self.bitboards[piece_moved] ^= end_bit
+        self.occupancy[color] ^= start_bit | end_bit
+        if piece_captured != "--":
+            if move & ENPASSANT_FLAG:
+                captured_bit = 1 << ((start_square & 56) | (end_square & 7))
+            else:
+                captured_bit = end_bit
+            self.bitboards[piece_captured] ^= captured_bit
+            self.occupancy[piece_captured[0]] ^= captured_bit
+        if move & CASTLE_FLAG:
+            row_square = end_square & 56
+            if end_square - start_square == 2:  # king-side, rook jumps from the corner over the king
+                rook_bits = 1 << (row_square + 7) | 1 << (row_square + 5)
+            else:  # queen-side
+                rook_bits = 1 << row_square | 1 << (row_square + 3)
+            self.bitboards[color + "R"] ^= rook_bits
+            self.occupancy[color] ^= rook_bits
 
     def makeMove(self, move):
         """
-        Takes a Move as a parameter and executes it.
-        (this will not work for castling, pawn promotion and en-passant)
+        Takes a Move or a move code as a parameter and executes it.
+        The move log keeps the codes, Move.fromCode turns them back into Moves.
         """
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        if type(move) is not int:
+            move = move.code
+        start_square = move & 63
+        end_square = (move >> 6) & 63
+        start_row, start_col = start_square >> 3, start_square & 7
+        end_row, end_col = end_square >> 3, end_square & 7
+        piece_moved = MOVE_PIECES[(move >> PIECE_MOVED_SHIFT) & 15]
+        previous_castling_key = self.current_castling_rights.zobristKey()
+        previous_enpassant = self.enpassant_possible
+        self.board[start_row][start_col] = "--"
+        self.board[end_row][end_col] = piece_moved
         self.move_log.append(move)  # log the move so we can undo it later
         self.white_to_move = not self.white_to_move  # switch players
         # update king's location if moved
-        if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+        if piece_moved == "wK":
+            self.white_king_location = (end_row, end_col)
+        elif piece_moved == "bK":
+            self.black_king_location = (end_row, end_col)
 
         # pawn promotion
-        if move.is_pawn_promotion:
-            # if not is_AI:
-            #    promoted_piece = input("Promote to Q, R, B, or N:") #take this to UI later
-            #    self.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted_piece
-            # else:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+        if move & PROMOTION_FLAG:
+            self.board[end_row][end_col] = piece_moved[0] + Move.promotion_pieces[(move >> PROMOTION_SHIFT) & 3]
 
         # enpassant move
-        if move.is_enpassant_move:
-            self.board[move.start_row][move.end_col] = "--"  # capturing the pawn
+        if move & ENPASSANT_FLAG:
+            self.board[start_row][end_col] = "--"  # capturing the pawn
 
         # update enpassant_possible variable
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:  # only on 2 square pawn advance
-            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+        if piece_moved[1] == "p" and abs(start_row - end_row) == 2:  # only on 2 square pawn advance
+            self.enpassant_possible = ((start_row + end_row) // 2, start_col)
         else:
             self.enpassant_possible = ()
 
         # castle move
-        if move.is_castle_move:
-            if move.end_col - move.start_col == 2:  # king-side castle move
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][
-                    move.end_col + 1]  # moves the rook to its new square
-                self.board[move.end_row][move.end_col + 1] = '--'  # erase old rook
+        if move & CASTLE_FLAG:
+            if end_col - start_col == 2:  # king-side castle move
+                self.board[end_row][end_col - 1] = self.board[end_row][end_col + 1]  # moves the rook to its new square
+                self.board[end_row][end_col + 1] = '--'  # erase old rook
             else:  # queen-side castle move
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][
-                    move.end_col - 2]  # moves the rook to its new square
-                self.board[move.end_row][move.end_col - 2] = '--'  # erase old rook
+                self.board[end_row][end_col + 1] = self.board[end_row][end_col - 2]  # moves the rook to its new square
+                self.board[end_row][end_col - 2] = '--'  # erase old rook
 
         self.enpassant_possible_log.append(self.enpassant_possible)
+        self.updateBitboards(move)
 
         # update castling rights - whenever it is a rook or king move
         self.updateCastleRights(move)
         self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                                    self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+        self.updateZobristHash(move, previous_castling_key, previous_enpassant)
+        self.updateScore(move)
+
+        # move counters
+        if piece_moved[1] == "p" or move >> PIECE_CAPTURED_SHIFT:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.halfmove_clock_log.append(self.halfmove_clock)
+        if self.white_to_move:  # black just moved
+            self.fullmove_number += 1
+
+    def makeNullMove(self):
+        """
+        Pass the turn to the other side without moving, for null-move pruning in the search.
+        The null move is logged like a move, undoMove takes it back too.
+        """
+        self.move_log.append(NULL_MOVE)
+        self.white_to_move = not self.white_to_move
+        zobrist_hash = self.zobrist_hash ^ ZOBRIST_TURN_KEY
+        if self.enpassant_possible != ():
+            zobrist_hash ^= ZOBRIST_ENPASSANT_KEYS[self.enpassant_possible[1]]
+            self.enpassant_possible = ()
+        self.enpassant_possible_log.append(self.enpassant_possible)
+        self.zobrist_hash = zobrist_hash
+        self.zobrist_hash_log.append(zobrist_hash)
+        self.halfmove_clock = 0  # nothing before a null move can be repeated after it
+        self.halfmove_clock_log.append(self.halfmove_clock)
+
+    def undoNullMove(self):
+        """
+        Undo the null move made last.
+        """
+        self.move_log.pop()
+        self.white_to_move = not self.white_to_move
+        self.enpassant_possible_log.pop()
+        self.enpassant_possible = self.enpassant_possible_log[-1]
+        self.zobrist_hash_log.pop()
+        self.zobrist_hash = self.zobrist_hash_log[-1]
+        self.halfmove_clock_log.pop()
+        self.halfmove_clock = self.halfmove_clock_log[-1]
+        self.checkmate = False
+        self.stalemate = False
 
     def undoMove(self):
         """
         Undo the last move
         """
-        if len(self.move_log) != 0:  # make sure that there is a move to undo
+        if len(self.move_log) != 0 and self.move_log[-1] == NULL_MOVE:
+            self.undoNullMove()
+        elif len(self.move_log) != 0:  # make sure that there is a move to undo
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            start_square = move & 63
+            end_square = (move >> 6) & 63
+            start_row, start_col = start_square >> 3, start_square & 7
+            end_row, end_col = end_square >> 3, end_square & 7
+            piece_moved = MOVE_PIECES[(move >> PIECE_MOVED_SHIFT) & 15]
+            piece_captured = MOVE_PIECES[move >> PIECE_CAPTURED_SHIFT]
+            self.board[start_row][start_col] = piece_moved
+            self.board[end_row][end_col] = piece_captured
             self.white_to_move = not self.white_to_move  # swap players
             # update the king's position if needed
-            if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+            if piece_moved == "wK":
+                self.white_king_location = (start_row, start_col)
+            elif piece_moved == "bK":
+                self.black_king_location = (start_row, start_col)
             # undo en passant move
-            if move.is_enpassant_move:
-                self.board[move.end_row][move.end_col] = "--"  # leave landing square blank
-                self.board[move.start_row][move.end_col] = move.piece_captured
+            if move & ENPASSANT_FLAG:
+                self.board[end_row][end_col] = "--"  # leave landing square blank
+                self.board[start_row][end_col] = piece_captured
 
             self.enpassant_possible_log.pop()
             self.enpassant_possible = self.enpassant_possible_log[-1]
 
             # undo castle rights
             self.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            self.current_castling_rights = self.castle_rights_log[
-                -1]  # set the current castle rights to the last one in the list
+            # set the current castle rights to a copy of the last one in the list,
+            # updateCastleRights mutates them in place and must not rewrite the log
+            last_rights = self.castle_rights_log[-1]
+            self.current_castling_rights = CastleRights(last_rights.wks, last_rights.bks,
+                                                        last_rights.wqs, last_rights.bqs)
             # undo the castle move
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2:  # king-side
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1]
-                    self.board[move.end_row][move.end_col - 1] = '--'
+            if move & CASTLE_FLAG:
+                if end_col - start_col == 2:  # king-side
+                    self.board[end_row][end_col + 1] = self.board[end_row][end_col - 1]
+                    self.board[end_row][end_col - 1] = '--'
                 else:  # queen-side
-                    self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
-                    self.board[move.end_row][move.end_col + 1] = '--'
+                    self.board[end_row][end_col - 2] = self.board[end_row][end_col + 1]
+                    self.board[end_row][end_col + 1] = '--'
+            self.updateBitboards(move)
+            self.zobrist_hash_log.pop()
+            self.zobrist_hash = self.zobrist_hash_log[-1]
+            self.halfmove_clock_log.pop()
+            self.halfmove_clock = self.halfmove_clock_log[-1]
+            self.score_log.pop()
+            self.score = self.score_log[-1]
+            if not self.white_to_move:  # undid a black move
+                self.fullmove_number -= 1
             self.checkmate = False
             self.stalemate = False
 
     def updateCastleRights(self, move):
         """
-        Update the castle rights given the move
+        Update the castle rights given the move code
         """
-        if move.piece_captured == "wR":
-            if move.end_col == 0:  # left rook
+        start_square = move & 63
+        end_square = (move >> 6) & 63
+        piece_moved = MOVE_PIECES[(move >> PIECE_MOVED_SHIFT) & 15]
+        piece_captured = MOVE_PIECES[move >> PIECE_CAPTURED_SHIFT]
+        if piece_captured == "wR":
+            if end_square == 56:  # left rook
                 self.current_castling_rights.wqs = False
-            elif move.end_col == 7:  # right rook
+            elif end_square == 63:  # right rook
                 self.current_castling_rights.wks = False
-        elif move.piece_captured == "bR":
-            if move.end_col == 0:  # left rook
+        elif piece_captured == "bR":
+            if end_square == 0:  # left rook
                 self.current_castling_rights.bqs = False
-            elif move.end_col == 7:  # right rook
+            elif end_square == 7:  # right rook
                 self.current_castling_rights.bks = False
 
-        if move.piece_moved == 'wK':
+        if piece_moved == 'wK':
             self.current_castling_rights.wqs = False
             self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bK':
+        elif piece_moved == 'bK':
             self.current_castling_rights.bqs = False
             self.current_castling_rights.bks = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.bks = False
+        elif piece_moved == 'wR':
+            if start_square == 56:  # left rook
+                self.current_castling_rights.wqs = False
+            elif start_square == 63:  # right rook
+                self.current_castling_rights.wks = False
+        elif piece_moved == 'bR':
+            if start_square == 0:  # left rook
+                self.current_castling_rights.bqs = False
+            elif start_square == 7:  # right rook
+                self.current_castling_rights.bks = False
 
     def getValidMoves(self):
         """
-        All moves considering checks.
+        All moves considering checks, as Move objects.
+        """
+        return [Move.fromCode(move) for move in self.getValidMoveCodes()]
+
+    def getValidMoveCodes(self):
+        """
+        All moves considering checks, as move codes. Also sets checkmate and stalemate.
         """
         temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                           self.current_castling_rights.wqs, self.current_castling_rights.bqs)
-        # advanced algorithm
-        moves = []
-
-        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        # advanced algorithm: the generators only emit legal moves, limited by the masks set here
+        self.updateMoveMasks()
 
         if self.white_to_move:
             king_row = self.white_king_location[0]
@@ -175,43 +613,16 @@ class GameState:
         else:
             king_row = self.black_king_location[0]
             king_col = self.black_king_location[1]
-        if self.in_check:
-            if len(self.checks) == 1:  # only 1 check, block the check or move the king
-                moves = self.getAllPossibleMoves()
-                # to block the check you must put a piece into one of the squares between the enemy piece and your king
-                check = self.checks[0]  # check information
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []  # squares that pieces can move to
-                # if knight, must capture the knight or move your king, other pieces can be blocked
-                if piece_checking[1] == "N":
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i,
-                                        king_col + check[3] * i)  # check[2] and check[3] are the check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[
-                            1] == check_col:  # once you get to piece and check
-                            break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # iterate through the list backwards when removing elements
-                    if moves[i].piece_moved[1] != "K":  # move doesn't move king so it must block or capture
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:  # move doesn't block or capture piece
-                            moves.remove(moves[i])
-            else:  # double check, king has to move
-                self.getKingMoves(king_row, king_col, moves)
-        else:  # not in check - all moves are fine
+        if len(self.checks) > 1:  # double check, king has to move
+            moves = []
+            self.getKingMoves(king_row, king_col, moves)
+        else:  # not in check or 1 check, which the other pieces have to block or capture if the king doesn't move
             moves = self.getAllPossibleMoves()
-            if self.white_to_move:
-                self.getCastleMoves(self.white_king_location[0], self.white_king_location[1], moves)
-            else:
-                self.getCastleMoves(self.black_king_location[0], self.black_king_location[1], moves)
+            if not self.in_check:
+                self.getCastleMoves(king_row, king_col, moves)
 
         if len(moves) == 0:
-            if self.inCheck():
+            if self.in_check:
                 self.checkmate = True
             else:
                 self.stalemate = True
@@ -222,6 +633,106 @@ class GameState:
         self.current_castling_rights = temp_castle_rights
         return moves
 
+    def getCaptureMoveCodes(self):
+        """
+        Legal captures and promotions as move codes, for the quiescence search. Quiet moves are never generated.
+        Unlike getValidMoveCodes it doesn't update checkmate and stalemate.
+        """
+        self.updateMoveMasks()
+        return self.getAllPossibleMoves(self.occupancy["b" if self.white_to_move else "w"])
+
+    def hasLegalMove(self):
+        """
+        Whether the side to move has any legal move, stopping at the first one found. The other pieces are tried
+        before the king, their moves only need the check mask, not the squares the enemy attacks.
+        """
+        self.updateCheckMask()
+        color = "w" if self.white_to_move else "b"
+        moves = []
+        if len(self.checks) < 2:  # in double check only the king can move
+            for piece in "NBRQp":
+                for square in ChessBitboard.squares(self.bitboards[color + piece]):
+                    self.moveFunctions[piece](square >> 3, square & 7, moves)
+                    if moves:
+                        return True
+        self.updateEnemyAttacks()
+        king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+        self.getKingMoves(king_row, king_col, moves)  # castling is only legal when stepping aside is too
+        return len(moves) != 0
+
+    def isGameOver(self):
+        """
+        Whether the side to move is checkmated or stalemated. Sets checkmate and stalemate like getValidMoveCodes
+        does, but stops at the first legal move instead of generating them all and only looks at check if there is
+        none.
+        """
+        if self.hasLegalMove():
+            self.checkmate = False
+            self.stalemate = False
+            return False
+        in_check = self.inCheck()
+        self.checkmate = in_check
+        self.stalemate = not in_check
+        return True
+
+    def repetitionCount(self):
+        """
+        How many times the position occurred before, by the hashes of the earlier positions. Only positions since the
+        last capture or pawn move can be the same.
+        """
+        log = self.zobrist_hash_log
+        count = 0
+        for index in range(len(log) - 3, max(len(log) - 1 - self.halfmove_clock, 0) - 1, -2):
+            if log[index] == self.zobrist_hash:
+                count += 1
+        return count
+
+    def isInsufficientMaterial(self):
+        """
+        Whether neither side has the pieces left to checkmate: kings alone, with a single knight or bishop,
+        or with bishops that all stand on squares of the same color.
+        """
+        bitboards = self.bitboards
+        if bitboards["wp"] | bitboards["bp"] | bitboards["wR"] | bitboards["bR"] | bitboards["wQ"] | bitboards["bQ"]:
+            return False
+        knights = bitboards["wN"] | bitboards["bN"]
+        bishops = bitboards["wB"] | bitboards["bB"]
+        if ChessBitboard.popCount(knights | bishops) <= 1:
+            return True
+        return not knights and (not bishops & ChessBitboard.LIGHT_SQUARES or not bishops & ChessBitboard.DARK_SQUARES)
+
+    def getDrawReason(self):
+        """
+        Why the game is a draw other than by stalemate: "fifty-move rule", "threefold repetition" or
+        "insufficient material", None if it isn't. A checkmate on the hundredth half move still wins,
+        so look for checkmate first.
+        """
+        if self.halfmove_clock >= 100:
+            return "fifty-move rule"
+        if self.repetitionCount() >= 2:
+            return "threefold repetition"
+        if self.isInsufficientMaterial():
+            return "insufficient material"
+        return None
+
+    def isValidMoveCode(self, move):
+        """
+        Whether a move code, e.g. one stored by the search, is legal in the position. Only the moves of the piece on
+        its start square are generated. Needs the masks of updateMoveMasks for the position.
+        """
+        start_square = move & 63
+        row, col = start_square >> 3, start_square & 7
+        piece = self.board[row][col]
+        if piece == "--" or piece != MOVE_PIECES[(move >> PIECE_MOVED_SHIFT) & 15] or \
+                (piece[0] == "w") != self.white_to_move:
+            return False
+        moves = []
+        if move & CASTLE_FLAG:
+            self.getCastleMoves(row, col, moves)
+        else:
+            self.moveFunctions[piece[1]](row, col, moves, 1 << ((move >> 6) & 63))
+        return move in moves
+
     def isProtecting(self):
         pass
 
@@ -238,13 +749,30 @@ class GameState:
         """
         Determine if enemy can attack the square row col
         """
-        self.white_to_move = not self.white_to_move  # switch to opponent's point of view
-        opponents_moves = self.getAllPossibleMoves()
-        self.white_to_move = not self.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # square is under attack
-                return True
-        return False
+        return self.isSquareAttacked(row, col, "b" if self.white_to_move else "w")
+
+    def isSquareAttacked(self, row, col, attacker_color, occupied=None):
+        """
+        Determine if any piece of attacker_color ("w" or "b") attacks the square row col.
+        Looks outwards from the square with the attack tables instead of generating the attacker's moves.
+        occupied replaces the blockers sliding pieces see, e.g. to look through a king that is about to move.
+        """
+        square = row * 8 + col
+        bitboards = self.bitboards
+        defender_color = "b" if attacker_color == "w" else "w"
+        # a pawn attacks this square from where a defending pawn standing here would attack
+        if ChessBitboard.PAWN_ATTACKS[defender_color][square] & bitboards[attacker_color + "p"]:
+            return True
+        if ChessBitboard.KNIGHT_ATTACKS[square] & bitboards[attacker_color + "N"]:
+            return True
+        if ChessBitboard.KING_ATTACKS[square] & bitboards[attacker_color + "K"]:
+            return True
+        if occupied is None:
+            occupied = self.occupancy["w"] | self.occupancy["b"]
+        queens = bitboards[attacker_color + "Q"]
+        if ChessBitboard.rookAttacks(square, occupied) & (bitboards[attacker_color + "R"] | queens):
+            return True
+        return bool(ChessBitboard.bishopAttacks(square, occupied) & (bitboards[attacker_color + "B"] | queens))
 
     # def squareUnderProtection(self, row, col):
     #     """
@@ -258,17 +786,22 @@ class GameState:
     #             return True
     #     return False
 
-    def getAllPossibleMoves(self):
+    def getAllPossibleMoves(self, target_mask=ChessBitboard.FULL):
         """
-        All moves without considering checks.
+        All legal moves except castling, as move codes. Needs the masks of updateMoveMasks for the position.
+        target_mask limits the moves to those that end on its squares (or capture on them, for en passant),
+        pawns may always push to promote.
         """
         moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0]
-                if (turn == "w" and self.white_to_move) or (turn == "b" and not self.white_to_move):
-                    piece = self.board[row][col][1]
-                    self.moveFunctions[piece](row, col, moves)  # calls appropriate move function based on piece type
+        color = "w" if self.white_to_move else "b"
+        for piece in "pNBRQK":
+            bitboard = self.bitboards[color + piece]
+            while bitboard:
+                lsb = bitboard & -bitboard
+                square = lsb.bit_length() - 1
+                # calls appropriate move function based on piece type
+                self.moveFunctions[piece](square >> 3, square & 7, moves, target_mask)
+                bitboard ^= lsb
         return moves
 
     # def getAllDependents(self):
@@ -281,8 +814,74 @@ class GameState:
     #                 self.moveFunctions[piece](row, col, dependents)  # calls appropriate move function based on piece type
     #     return dependents
 
+    def updateMoveMasks(self):
+        """
+        Work out what the move generators need to emit only legal moves: in_check, pins and checks, and
+        check_mask - the squares moves other than the king's have to end on: all of them when not in check,
+        the checking piece and the squares between it and the king for a single check and none for a double check,
+        enemy_attacks - the squares the enemy attacks, which the king can't move to.
+        """
+        self.updateCheckMask()
+        self.updateEnemyAttacks()
+
+    def updateCheckMask(self):
+        """
+        The masks of updateMoveMasks that the moves of pieces other than the king need:
+        in_check, pins, checks and check_mask.
+        """
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+        king_square = king_row * 8 + king_col
+        if not self.in_check:
+            self.check_mask = ChessBitboard.FULL
+        elif len(self.checks) == 1:
+            check_row, check_col, d_row, d_col = self.checks[0]
+            check_square = check_row * 8 + check_col
+            if self.board[check_row][check_col][1] in ("N", "p"):  # can't be blocked, only captured
+                self.check_mask = 1 << check_square
+            else:
+                rays = ChessBitboard.RAYS[(d_row, d_col)]
+                self.check_mask = rays[king_square] ^ rays[check_square]
+        else:
+            self.check_mask = 0
+
+    def updateEnemyAttacks(self):
+        """
+        The enemy_attacks mask of updateMoveMasks, which king moves and castling need.
+        """
+        if self.white_to_move:
+            enemy_color = "b"
+            king_row, king_col = self.white_king_location
+        else:
+            enemy_color = "w"
+            king_row, king_col = self.black_king_location
+        king_square = king_row * 8 + king_col
+        # without the king, which doesn't shield the squares behind it from a slider it steps away from
+        occupied = (self.occupancy["w"] | self.occupancy["b"]) ^ (1 << king_square)
+        self.enemy_attacks = self.getAttackMap(enemy_color, occupied)
+
+    def getAttackMap(self, attacker_color, occupied=None):
+        """
+        Bitboard of every square that a piece of attacker_color ("w" or "b") attacks.
+        occupied replaces the blockers sliding pieces see.
+        """
+        bitboards = self.bitboards
+        if occupied is None:
+            occupied = self.occupancy["w"] | self.occupancy["b"]
+        attacks = ChessBitboard.pawnAttacks(bitboards[attacker_color + "p"], attacker_color)
+        for square in ChessBitboard.squares(bitboards[attacker_color + "N"]):
+            attacks |= ChessBitboard.KNIGHT_ATTACKS[square]
+        for square in ChessBitboard.squares(bitboards[attacker_color + "K"]):
+            attacks |= ChessBitboard.KING_ATTACKS[square]
+        queens = bitboards[attacker_color + "Q"]
+        for square in ChessBitboard.squares(bitboards[attacker_color + "R"] | queens):
+            attacks |= ChessBitboard.rookAttacks(square, occupied)
+        for square in ChessBitboard.squares(bitboards[attacker_color + "B"] | queens):
+            attacks |= ChessBitboard.bishopAttacks(square, occupied)
+        return attacks
+
     def checkForPinsAndChecks(self):
-        pins = []  # squares pinned and the direction its pinned from
+        pins = {}  # the pin line of every pinned piece, by its square
         checks = []  # squares where enemy is applying a check
         in_check = False
         if self.white_to_move:
@@ -295,273 +894,168 @@ class GameState:
             ally_color = "b"
             start_row = self.black_king_location[0]
             start_col = self.black_king_location[1]
+        king_square = start_row * 8 + start_col
+        allies = self.occupancy[ally_color]
+        occupied = allies | self.occupancy[enemy_color]
+        orthogonal_attackers = self.bitboards[enemy_color + "R"] | self.bitboards[enemy_color + "Q"]
+        diagonal_attackers = self.bitboards[enemy_color + "B"] | self.bitboards[enemy_color + "Q"]
         # check outwards from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            direction = directions[j]
-            possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + direction[0] * i
-                end_col = start_col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "K":
-                        if possible_pin == ():  # first allied piece could be pinned
-                            possible_pin = (end_row, end_col, direction[0], direction[1])
-                        else:  # 2nd allied piece - no check or pin from this direction
-                            break
-                    elif end_piece[0] == enemy_color:
-                        enemy_type = end_piece[1]
-                        # 5 possibilities in this complex conditional
-                        # 1.) orthogonally away from king and piece is a rook
-                        # 2.) diagonally away from king and piece is a bishop
-                        # 3.) 1 square away diagonally from king and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and enemy_type == "R") or (4 <= j <= 7 and enemy_type == "B") or (
-                                i == 1 and enemy_type == "p" and (
-                                (enemy_color == "w" and 6 <= j <= 7) or (enemy_color == "b" and 4 <= j <= 5))) or (
-                                enemy_type == "Q") or (i == 1 and enemy_type == "K"):
-                            if possible_pin == ():  # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_col, direction[0], direction[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying checks
-                            break
-                else:
-                    break  # off board
-        # check for knight checks
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
-        for move in knight_moves:
-            end_row = start_row + move[0]
-            end_col = start_col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == "N":  # enemy knight attacking a king
-                    in_check = True
-                    checks.append((end_row, end_col, move[0], move[1]))
+        for direction in ChessBitboard.DIRECTIONS:
+            blockers = ChessBitboard.RAYS[direction][king_square] & occupied
+            if not blockers:
+                continue
+            attackers = orthogonal_attackers if direction in ChessBitboard.ORTHOGONAL_DIRECTIONS else diagonal_attackers
+            positive = direction in ChessBitboard.POSITIVE_DIRECTIONS
+            nearest = ChessBitboard.lowestSquare(blockers) if positive else ChessBitboard.highestSquare(blockers)
+            if allies >> nearest & 1:  # first allied piece could be pinned
+                blockers ^= 1 << nearest
+                if blockers:
+                    behind = ChessBitboard.lowestSquare(blockers) if positive else ChessBitboard.highestSquare(blockers)
+                    if attackers >> behind & 1:  # piece blocking so pin
+                        pins[nearest] = ChessBitboard.LINES[direction][nearest]
+            elif attackers >> nearest & 1:  # no piece blocking, so check
+                in_check = True
+                checks.append((nearest >> 3, nearest & 7, direction[0], direction[1]))
+        # pawns, knights and the enemy king only attack adjacent or fixed squares
+        pawn_attackers = ChessBitboard.PAWN_ATTACKS[ally_color][king_square] & self.bitboards[enemy_color + "p"]
+        adjacent_attackers = (pawn_attackers |
+                              (ChessBitboard.KNIGHT_ATTACKS[king_square] & self.bitboards[enemy_color + "N"]) |
+                              (ChessBitboard.KING_ATTACKS[king_square] & self.bitboards[enemy_color + "K"]))
+        for square in ChessBitboard.squares(adjacent_attackers):
+            in_check = True
+            checks.append((square >> 3, square & 7, (square >> 3) - start_row, (square & 7) - start_col))
         return in_check, pins, checks
 
-    def getPawnMoves(self, row, col, moves):
+    def getPinMask(self, row, col):
+        """
+        Bitboard of the squares the piece at row, col can move to without leaving its pin line.
+        """
+        return self.pins.get(row * 8 + col, ChessBitboard.FULL)
+
+    def addMoves(self, row, col, targets, moves):
+        """
+        Add a move from row, col to every square in the targets bitboard.
+        """
+        board = self.board
+        move_bits = row * 8 + col | PIECE_MOVED_BITS[board[row][col]]
+        while targets:
+            lsb = targets & -targets
+            end_square = lsb.bit_length() - 1
+            moves.append(move_bits | end_square << 6 | PIECE_CAPTURED_BITS[board[end_square >> 3][end_square & 7]])
+            targets ^= lsb
+
+    def addPawnMove(self, row, col, end_row, end_col, moves):
+        """
+        Add a pawn move, once for every piece the pawn can promote to when it reaches the last rank.
+        """
+        move = encodeMove(row, col, end_row, end_col, self.board[row][col], self.board[end_row][end_col])
+        if end_row == 0 or end_row == 7:
+            for promotion_index in range(len(Move.promotion_pieces)):
+                moves.append(move | PROMOTION_FLAG | promotion_index << PROMOTION_SHIFT)
+        else:
+            moves.append(move)
+
+    def getPawnMoves(self, row, col, moves, target_mask=ChessBitboard.FULL):
         """
         Get all the pawn moves for the pawn located at row, col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        pin_mask = self.getPinMask(row, col)
+        check_mask = self.check_mask
 
         if self.white_to_move:
             move_amount = -1
             start_row = 6
             enemy_color = "b"
+            ally_color = "w"
             king_row, king_col = self.white_king_location
         else:
             move_amount = 1
             start_row = 1
             enemy_color = "w"
+            ally_color = "b"
             king_row, king_col = self.black_king_location
 
-        if self.board[row + move_amount][col] == "--":  # 1 square pawn advance
-            if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
-                if row == start_row and self.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
-                    moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
-        if col - 1 >= 0:  # capture to the left
-            if not piece_pinned or pin_direction == (move_amount, -1):
-                if self.board[row + move_amount][col - 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
-                if (row + move_amount, col - 1) == self.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col - 1)
-                            outside_range = range(col + 1, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col, -1)
-                            outside_range = range(col - 2, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col - 1), self.board, is_enpassant_move=True))
-        if col + 1 <= 7:  # capture to the right
-            if not piece_pinned or pin_direction == (move_amount, +1):
-                if self.board[row + move_amount][col + 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
-                if (row + move_amount, col + 1) == self.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col)
-                            outside_range = range(col + 2, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col + 1, -1)
-                            outside_range = range(col - 1, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col + 1), self.board, is_enpassant_move=True))
-
-    def getRookMoves(self, row, col, moves):
+        square = row * 8 + col
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        one_step = square + 8 * move_amount
+        if not occupied >> one_step & 1:  # 1 square pawn advance
+            if pin_mask >> one_step & 1:
+                if check_mask >> one_step & 1 and (target_mask >> one_step & 1 or row + move_amount in (0, 7)):
+                    self.addPawnMove(row, col, row + move_amount, col, moves)
+                two_step = one_step + 8 * move_amount
+                if row == start_row and not occupied >> two_step & 1 and \
+                        (target_mask & check_mask) >> two_step & 1:  # 2 square advance
+                    moves.append(encodeMove(row, col, row + 2 * move_amount, col, ally_color + "p", "--"))
+        attacks = ChessBitboard.PAWN_ATTACKS[ally_color][square] & pin_mask
+        for end_square in ChessBitboard.squares(attacks & self.occupancy[enemy_color] & target_mask & check_mask):
+            self.addPawnMove(row, col, end_square >> 3, end_square & 7, moves)
+        if self.enpassant_possible != ():
+            enpassant_square = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+            captured_square = row * 8 + self.enpassant_possible[1]
+            # target_mask and check_mask may hold either end of an en passant capture
+            if attacks >> enpassant_square & 1 and \
+                    (target_mask >> enpassant_square | target_mask >> captured_square) & \
+                    (check_mask >> enpassant_square | check_mask >> captured_square) & 1:
+                # both pawns leave their squares at once, which can uncover a slider on the king
+                occupied_after = (occupied ^ (1 << square) ^ (1 << captured_square)) | (1 << enpassant_square)
+                king_square = king_row * 8 + king_col
+                orthogonal_attackers = self.bitboards[enemy_color + "R"] | self.bitboards[enemy_color + "Q"]
+                diagonal_attackers = self.bitboards[enemy_color + "B"] | self.bitboards[enemy_color + "Q"]
+                if not (ChessBitboard.rookAttacks(king_square, occupied_after) & orthogonal_attackers or
+                        ChessBitboard.bishopAttacks(king_square, occupied_after) & diagonal_attackers):
+                    moves.append(encodeMove(row, col, self.enpassant_possible[0], self.enpassant_possible[1],
+                                            ally_color + "p", enemy_color + "p", ENPASSANT_FLAG))
+
+    def getRookMoves(self, row, col, moves, target_mask=ChessBitboard.FULL):
         """
         Get all the rook moves for the rook located at row, col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[row][col][
-                    1] != "Q":  # can't remove queen from pin on rook moves, only remove it on bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
-        enemy_color = "b" if self.white_to_move else "w"
         ally_color = "w" if self.white_to_move else "b"
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        targets = ChessBitboard.rookAttacks(row * 8 + col, occupied) & ~self.occupancy[ally_color]
+        self.addMoves(row, col, targets & target_mask & self.check_mask & self.getPinMask(row, col), moves)
 
-        for direction in directions:
-            for i in range(1, 8):
-                end_row = row + direction[0] * i
-                end_col = col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check for possible moves only in boundaries of the board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                        # elif end_piece == ally_color:
-                        #     dependents += 1
-                        #     # break
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:  # friendly piece
-                            break
-                else:  # off board
-                    break
-
-    def getKnightMoves(self, row, col, moves):
+    def getKnightMoves(self, row, col, moves, target_mask=ChessBitboard.FULL):
         """
         Get all the knight moves for the knight located at row col and add the moves to the list.
         """
-        piece_pinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
-
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2),
-                        (1, -2))  # up/left up/right right/up right/down down/left down/right left/up left/down
         ally_color = "w" if self.white_to_move else "b"
-        for move in knight_moves:
-            end_row = row + move[0]
-            end_col = col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:  # so its either enemy piece or empty square
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+        targets = ChessBitboard.KNIGHT_ATTACKS[row * 8 + col] & ~self.occupancy[ally_color]
+        # a pinned knight can never move, its pin mask is empty of knight moves
+        self.addMoves(row, col, targets & target_mask & self.check_mask & self.getPinMask(row, col), moves)
 
-    def getBishopMoves(self, row, col, moves):
+    def getBishopMoves(self, row, col, moves, target_mask=ChessBitboard.FULL):
         """
         Get all the bishop moves for the bishop located at row col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # diagonals: up/left up/right down/right down/left
-        enemy_color = "b" if self.white_to_move else "w"
-        for direction in directions:
-            for i in range(1, 8):
-                end_row = row + direction[0] * i
-                end_col = col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check if the move is on board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:  # friendly piece
-                            break
-                else:  # off board
-                    break
-
-    def getQueenMoves(self, row, col, moves):
+        ally_color = "w" if self.white_to_move else "b"
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        targets = ChessBitboard.bishopAttacks(row * 8 + col, occupied) & ~self.occupancy[ally_color]
+        self.addMoves(row, col, targets & target_mask & self.check_mask & self.getPinMask(row, col), moves)
+
+    def getQueenMoves(self, row, col, moves, target_mask=ChessBitboard.FULL):
         """
         Get all the queen moves for the queen located at row col and add the moves to the list.
         """
-        self.getBishopMoves(row, col, moves)
-        self.getRookMoves(row, col, moves)
+        ally_color = "w" if self.white_to_move else "b"
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        targets = ChessBitboard.queenAttacks(row * 8 + col, occupied) & ~self.occupancy[ally_color]
+        self.addMoves(row, col, targets & target_mask & self.check_mask & self.getPinMask(row, col), moves)
 
-    def getKingMoves(self, row, col, moves):
+    def getKingMoves(self, row, col, moves, target_mask=ChessBitboard.FULL):
         """
         Get all the king moves for the king located at row col and add the moves to the list.
         """
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = row + row_moves[i]
-            end_col = col + col_moves[i]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:  # not an ally piece - empty or enemy
-                    # place king on end square and check for checks
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    # place king back on original location
-                    if ally_color == "w":
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
+        # the king steps out of check itself, so it ignores check_mask
+        targets = ChessBitboard.KING_ATTACKS[row * 8 + col] & ~self.occupancy[ally_color] & ~self.enemy_attacks
+        self.addMoves(row, col, targets & target_mask, moves)
 
     def getCastleMoves(self, row, col, moves):
         """
         Generate all valid castle moves for the king at (row, col) and add them to the list of moves.
         """
-        if self.squareUnderAttack(row, col):
+        if self.in_check:
             return  # can't castle while in check
         if (self.white_to_move and self.current_castling_rights.wks) or (
                 not self.white_to_move and self.current_castling_rights.bks):
@@ -572,13 +1066,13 @@ class GameState:
 
     def getKingsideCastleMoves(self, row, col, moves):
         if self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
-            if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.board, is_castle_move=True))
+            if not self.enemy_attacks >> (row * 8 + col + 1) & 3:  # neither square the king passes is attacked
+                moves.append(encodeMove(row, col, row, col + 2, self.board[row][col], "--", CASTLE_FLAG))
 
     def getQueensideCastleMoves(self, row, col, moves):
         if self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
-            if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
+            if not self.enemy_attacks >> (row * 8 + col - 2) & 3:
+                moves.append(encodeMove(row, col, row, col - 2, self.board[row][col], "--", CASTLE_FLAG))
 
 
 class CastleRights:
@@ -588,6 +1082,21 @@ class CastleRights:
         self.wqs = wqs
         self.bqs = bqs
 
+    def zobristKey(self):
+        """
+        XOR of the Zobrist keys of the rights that are still available.
+        """
+        key = 0
+        if self.wks:
+            key ^= ZOBRIST_CASTLING_KEYS[0]
+        if self.wqs:
+            key ^= ZOBRIST_CASTLING_KEYS[1]
+        if self.bks:
+            key ^= ZOBRIST_CASTLING_KEYS[2]
+        if self.bqs:
+            key ^= ZOBRIST_CASTLING_KEYS[3]
+        return key
+
 
 class Move:
     # in chess, fields on the board are described by two symbols, one of them being number between 1-8 (which is corresponding to rows)
@@ -599,26 +1108,85 @@ class Move:
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3,
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
+    promotion_pieces = ("Q", "R", "B", "N")
+    __slots__ = ("code",)  # a Move is only a view of its move code, see MOVE_PIECES
 
-    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False):
-        self.start_row = start_square[0]
-        self.start_col = start_square[1]
-        self.end_row = end_square[0]
-        self.end_col = end_square[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
+    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False,
+                 promotion_piece="Q"):
+        start_row, start_col = start_square
+        end_row, end_col = end_square
+        piece_moved = board[start_row][start_col]
+        piece_captured = board[end_row][end_col]
+        flags = 0
         # pawn promotion
-        self.is_pawn_promotion = (self.piece_moved == "wp" and self.end_row == 0) or (
-                self.piece_moved == "bp" and self.end_row == 7)
+        if (piece_moved == "wp" and end_row == 0) or (piece_moved == "bp" and end_row == 7):
+            flags |= PROMOTION_FLAG
         # en passant
-        self.is_enpassant_move = is_enpassant_move
-        if self.is_enpassant_move:
-            self.piece_captured = "wp" if self.piece_moved == "bp" else "bp"
+        if is_enpassant_move:
+            flags |= ENPASSANT_FLAG
+            piece_captured = "wp" if piece_moved == "bp" else "bp"
         # castle move
-        self.is_castle_move = is_castle_move
+        if is_castle_move:
+            flags |= CASTLE_FLAG
+        self.code = encodeMove(start_row, start_col, end_row, end_col, piece_moved, piece_captured, flags,
+                               self.promotion_pieces.index(promotion_piece))
+
+    @classmethod
+    def fromCode(cls, code):
+        """
+        Move for a move code, e.g. from GameState.move_log.
+        """
+        move = cls.__new__(cls)
+        move.code = code
+        return move
+
+    @property
+    def start_row(self):
+        return (self.code >> 3) & 7
+
+    @property
+    def start_col(self):
+        return self.code & 7
+
+    @property
+    def end_row(self):
+        return (self.code >> 9) & 7
+
+    @property
+    def end_col(self):
+        return (self.code >> 6) & 7
+
+    @property
+    def piece_moved(self):
+        return MOVE_PIECES[(self.code >> PIECE_MOVED_SHIFT) & 15]
+
+    @property
+    def piece_captured(self):
+        return MOVE_PIECES[self.code >> PIECE_CAPTURED_SHIFT]
+
+    @property
+    def is_pawn_promotion(self):
+        return bool(self.code & PROMOTION_FLAG)
 
-        self.is_capture = self.piece_captured != "--"
-        self.moveID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+    @property
+    def promotion_piece(self):
+        return self.promotion_pieces[(self.code >> PROMOTION_SHIFT) & 3]  # only used by promotions
+
+    @property
+    def is_enpassant_move(self):
+        return bool(self.code & ENPASSANT_FLAG)
+
+    @property
+    def is_castle_move(self):
+        return bool(self.code & CASTLE_FLAG)
+
+    @property
+    def is_capture(self):
+        return self.code >> PIECE_CAPTURED_SHIFT != 0
+
+    @property
+    def moveID(self):
+        return self.code & MOVE_ID_MASK
 
     def __eq__(self, other):
         """
@@ -628,9 +1196,12 @@ class Move:
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
         if self.is_pawn_promotion:
-            return self.getRankFile(self.end_row, self.end_col) + "Q"
+            return self.getRankFile(self.end_row, self.end_col) + self.promotion_piece
         if self.is_castle_move:
             if self.end_col == 1:
                 return "0-0-0"
@@ -656,6 +1227,15 @@ class Move:
     def getRankFile(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
 
+    def getUciNotation(self):
+        """
+        Long algebraic notation as used by UCI, e.g. "e2e4", "e1g1" or "a7a8n".
+        """
+        notation = self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
+
     def __str__(self):
         if self.is_castle_move:
             return "0-0" if self.end_col == 6 else "0-0-0"
@@ -664,9 +1244,8 @@ class Move:
 
         if self.piece_moved[1] == "p":
             if self.is_capture:
-                return self.cols_to_files[self.start_col] + "x" + end_square
-            else:
-                return end_square + "Q" if self.is_pawn_promotion else end_square
+                end_square = self.cols_to_files[self.start_col] + "x" + end_square
+            return end_square + self.promotion_piece if self.is_pawn_promotion else end_square
 
         move_string = self.piece_moved[1]
         if self.is_capture:
@@ -1,7 +1,7 @@
 import pygame as p
-import ChessEngine, ChessAI
+import ChessEngine, ChessAI, ChessWorker
 import sys
-from multiprocessing import Process, Queue
+import time
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
 MOVE_LOG_PANEL_WIDTH = 250
@@ -9,17 +9,36 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8
 SQUARE_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15
+AI_TIME_LIMIT = 3  # seconds the AI may think about a move
+AI_PROCESSES = 1  # more than 1 splits the AI's search over that many cores, None uses all of them
+AI_OPENING_BOOK = None  # path of a Polyglot .bin opening book the AI plays from, None to search from the first move
+AI_TABLEBASES = None  # directory of the endgame tables made by ChessTablebase.py, None to play endgames without
 IMAGES = {}
+HIGHLIGHTS = {}  # translucent squares by color name
 
 
 def loadImages():
     """
     Initialize a global directory of images.
-    This will be called exactly once in the main.
+    This will be called exactly once in the main, after the display is set up.
+    The empty board and the highlight squares are rendered here too, once, so that drawing only has to blit.
     """
     pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
+        image = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
+        IMAGES[piece] = image.convert_alpha()  # in the display's pixel format, which blits fastest
+    board = p.Surface((BOARD_WIDTH, BOARD_HEIGHT)).convert()
+    colors = [p.Color("white"), p.Color("gray")]  # the top left square is always light
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            color = colors[((row + column) % 2)]
+            p.draw.rect(board, color, p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    IMAGES["board"] = board
+    for color in ("yellow", "light blue"):
+        highlight = p.Surface((SQUARE_SIZE, SQUARE_SIZE)).convert()
+        highlight.set_alpha(100)  # transparency value 0 -> transparent, 255 -> opaque
+        highlight.fill(p.Color(color))
+        HIGHLIGHTS[color] = highlight
 
 
 def main():
@@ -42,8 +61,14 @@ def main():
     game_over = False
     ai_thinking = False
     move_undone = False
-    move_finder_process = None
+    # one AI process for the whole session
+    ai_worker = ChessWorker.EngineWorker(AI_PROCESSES, book_path=AI_OPENING_BOOK, tablebase_path=AI_TABLEBASES)
     move_log_font = p.font.SysFont("Arial", 14, False, False)
+    # only what changed since the last frame is drawn and sent to the display
+    drawn_squares = {}  # what every square on the screen shows, see drawGameState, empty to draw them all
+    drawn_move_log = None  # the move log the panel shows
+    move_log_lines = []  # rendered lines of the move log panel
+    end_game_text = None  # the text shown over the board
     player_one = True  # if a human is playing white, then this will be True, else False
     player_two = False  # if a hyman is playing white, then this will be True, else False
 
@@ -51,6 +76,7 @@ def main():
         human_turn = (game_state.white_to_move and player_one) or (not game_state.white_to_move and player_two)
         for e in p.event.get():
             if e.type == p.QUIT:
+                ai_worker.close()
                 p.quit()
                 sys.exit()
             # mouse handler
@@ -70,6 +96,7 @@ def main():
                         for i in range(len(valid_moves)):
                             if move == valid_moves[i]:
                                 game_state.makeMove(valid_moves[i])
+                                ai_worker.makeMove(valid_moves[i])
                                 move_made = True
                                 animate = True
                                 square_selected = ()  # reset user clicks
@@ -81,12 +108,11 @@ def main():
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo when 'z' is pressed
                     game_state.undoMove()
+                    ai_worker.undoMove()  # also cancels the search if the AI was thinking
                     move_made = True
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    ai_thinking = False
                     move_undone = True
                 if e.key == p.K_r:  # reset the game when 'r' is pressed
                     game_state = ChessEngine.GameState()
@@ -96,102 +122,123 @@ def main():
                     move_made = False
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    ai_worker.newGame()
+                    ai_thinking = False
                     move_undone = True
 
         # AI move finder
         if not game_over and not human_turn and not move_undone:
             if not ai_thinking:
                 ai_thinking = True
-                return_queue = Queue()  # used to pass data between threads
-                move_finder_process = Process(target=ChessAI.findBestMove, args=(game_state, valid_moves, return_queue))
-                move_finder_process.start()
-
-            if not move_finder_process.is_alive():
-                ai_move = return_queue.get()
+                ai_start_time = time.time()
+                ai_worker.startSearch(ChessAI.MAX_DEPTH, AI_TIME_LIMIT)
+
+            # the AI sends its best move after every completed depth, keep the latest
+            ai_move, search_finished = ai_worker.poll()
+            # play as soon as the time is up, the search stops on its own at the same deadline
+            if search_finished or (ai_move is not None and time.time() - ai_start_time >= AI_TIME_LIMIT):
+                ai_worker.stopSearch()
                 if ai_move is None:
                     ai_move = ChessAI.findRandomMove(valid_moves)
                 game_state.makeMove(ai_move)
+                ai_worker.makeMove(ai_move)
                 move_made = True
                 animate = True
                 ai_thinking = False
 
         if move_made:
             if animate:
-                animateMove(game_state.move_log[-1], screen, game_state.board, clock)
+                animateMove(ChessEngine.Move.fromCode(game_state.move_log[-1]), screen, game_state.board, clock)
+                drawn_squares.clear()  # the animation drew over the board
             valid_moves = game_state.getValidMoves()
             move_made = False
             animate = False
             move_undone = False
 
-        drawGameState(screen, game_state, valid_moves, square_selected)
-
-        if not game_over:
-            drawMoveLog(screen, game_state, move_log_font)
-
+        text = None
         if game_state.checkmate:
             game_over = True
             if game_state.white_to_move:
-                drawEndGameText(screen, "Black wins by checkmate")
+                text = "Black wins by checkmate"
             else:
-                drawEndGameText(screen, "White wins by checkmate")
+                text = "White wins by checkmate"
 
         elif game_state.stalemate:
             game_over = True
-            drawEndGameText(screen, "Stalemate")
+            text = "Stalemate"
 
-        clock.tick(MAX_FPS)
-        p.display.flip()
+        elif game_state.getDrawReason() is not None:
+            game_over = True
+            text = "Draw by " + game_state.getDrawReason()
 
+        if end_game_text is not None and text != end_game_text:
+            drawn_squares.clear()  # the squares under the old text have to be drawn again
 
-def drawGameState(screen, game_state, valid_moves, square_selected):
-    """
-    Responsible for all the graphics within current game state.
-    """
-    drawBoard(screen)  # draw squares on the board
-    highlightSquares(screen, game_state, valid_moves, square_selected)
-    drawPieces(screen, game_state.board)  # draw pieces on top of those squares
+        dirty_rects = drawGameState(screen, game_state, valid_moves, square_selected, drawn_squares)
+
+        if text is not None and (dirty_rects or text != end_game_text):
+            dirty_rects.append(drawEndGameText(screen, text))
+        end_game_text = text
 
+        if game_state.move_log != drawn_move_log:
+            drawn_move_log = list(game_state.move_log)
+            dirty_rects.append(drawMoveLog(screen, game_state, move_log_font, move_log_lines))
 
-def drawBoard(screen):
+        clock.tick(MAX_FPS)
+        if dirty_rects:
+            p.display.update(dirty_rects)
+
+
+def drawGameState(screen, game_state, valid_moves, square_selected, drawn_squares):
     """
-    Draw the squares on the board.
-    The top left square is always light.
+    Responsible for all the graphics within current game state.
+    drawn_squares holds what every square on the screen shows, only the squares that should look different are drawn
+    and it is updated to match. Returns the rects that were drawn.
     """
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            color = colors[((row + column) % 2)]
-            p.draw.rect(screen, color, p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    dirty_rects = []
+    for square, look in getSquareLooks(game_state, valid_moves, square_selected).items():
+        if drawn_squares.get(square) != look:
+            drawn_squares[square] = look
+            dirty_rects.append(drawSquare(screen, square, look))
+    return dirty_rects
 
 
-def highlightSquares(screen, game_state, valid_moves, square_selected):
+def getSquareLooks(game_state, valid_moves, square_selected):
     """
-    Highlight square selected and moves for piece selected.
+    What every square should show: a dict of (piece, highlight colors) by (row, col).
+    The last move and the square selected are highlighted, and the moves of the piece selected.
     """
+    highlights = {}
     if (len(game_state.move_log)) > 0:
-        last_move = game_state.move_log[-1]
-        s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        s.set_alpha(100)
-        s.fill(p.Color('yellow'))
-        screen.blit(s, (last_move.end_col * SQUARE_SIZE, last_move.end_row * SQUARE_SIZE))
+        last_move = ChessEngine.Move.fromCode(game_state.move_log[-1])
+        highlights[(last_move.end_row, last_move.end_col)] = ("yellow",)
     if square_selected != ():
         row, col = square_selected
         if game_state.board[row][col][0] == (
                 'w' if game_state.white_to_move else 'b'):  # square_selected is a piece that can be moved
-            # highlight selected square
-            s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            s.set_alpha(100)  # transparency value 0 -> transparent, 255 -> opaque
-            s.fill(p.Color('light blue'))
-            screen.blit(s, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-            # highlight moves from that square
-            s.fill(p.Color('light blue'))
+            highlights[square_selected] = highlights.get(square_selected, ()) + ("light blue",)
             for move in valid_moves:
                 if move.start_row == row and move.start_col == col:
-                    screen.blit(s, (move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE))
+                    end_square = (move.end_row, move.end_col)
+                    highlights[end_square] = highlights.get(end_square, ()) + ("light blue",)
+    board = game_state.board
+    return {(row, column): (board[row][column], highlights.get((row, column), ()))
+            for row in range(DIMENSION) for column in range(DIMENSION)}
+
+
+def drawSquare(screen, square, look):
+    """
+    Draw one square from the pre-rendered board, its highlights and its piece. Returns the rect of the square.
+    """
+    row, column = square
+    piece, highlights = look
+    rect = p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    screen.blit(IMAGES["board"], rect, rect)
+    for color in highlights:
+        screen.blit(HIGHLIGHTS[color], rect)
+    if piece != "--":
+        screen.blit(IMAGES[piece], rect)
+    return rect
 
 
 def drawPieces(screen, board):
@@ -205,18 +252,19 @@ def drawPieces(screen, board):
                 screen.blit(IMAGES[piece], p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
 
 
-def drawMoveLog(screen, game_state, font):
+def drawMoveLog(screen, game_state, font, rendered_lines):
     """
-    Draws the move log.
+    Draws the move log. rendered_lines is a list of (text, rendered text) of the lines drawn last time,
+    only the lines whose text changed are rendered again. Returns the rect of the panel.
     """
     move_log_rect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
     p.draw.rect(screen, p.Color('black'), move_log_rect)
     move_log = game_state.move_log
     move_texts = []
     for i in range(0, len(move_log), 2):
-        move_string = str(i // 2 + 1) + '. ' + str(move_log[i]) + " "
+        move_string = str(i // 2 + 1) + '. ' + str(ChessEngine.Move.fromCode(move_log[i])) + " "
         if i + 1 < len(move_log):
-            move_string += str(move_log[i + 1]) + "  "
+            move_string += str(ChessEngine.Move.fromCode(move_log[i + 1])) + "  "
         move_texts.append(move_string)
 
     moves_per_row = 3
@@ -229,10 +277,20 @@ def drawMoveLog(screen, game_state, font):
             if i + j < len(move_texts):
                 text += move_texts[i + j]
 
-        text_object = font.render(text, True, p.Color('white'))
+        line = i // moves_per_row
+        if line < len(rendered_lines) and rendered_lines[line][0] == text:
+            text_object = rendered_lines[line][1]
+        else:
+            text_object = font.render(text, True, p.Color('white'))
+            if line < len(rendered_lines):
+                rendered_lines[line] = (text, text_object)
+            else:
+                rendered_lines.append((text, text_object))
         text_location = move_log_rect.move(padding, text_y)
         screen.blit(text_object, text_location)
         text_y += text_object.get_height() + line_spacing
+    del rendered_lines[(len(move_texts) + moves_per_row - 1) // moves_per_row:]  # lines of undone moves
+    return move_log_rect
 
 
 def drawEndGameText(screen, text):
@@ -243,34 +301,41 @@ def drawEndGameText(screen, text):
     screen.blit(text_object, text_location)
     text_object = font.render(text, False, p.Color('black'))
     screen.blit(text_object, text_location.move(2, 2))
+    return p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT)
 
 
 def animateMove(move, screen, board, clock):
     """
     Animating a move
+    Every frame only the square the piece left and the square it is drawn on are updated.
     """
-    global colors
     d_row = move.end_row - move.start_row
     d_col = move.end_col - move.start_col
     frames_per_square = 7  # frames to move one square
     frame_count = (abs(d_row) + abs(d_col)) * frames_per_square
+    # the board after the move without the piece moved, which is drawn over it frame by frame
+    background = IMAGES["board"].copy()
+    drawPieces(background, board)
+    # erase the piece moved from its ending square
+    end_square = p.Rect(move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    background.blit(IMAGES["board"], end_square, end_square)
+    # draw captured piece onto rectangle
+    if move.piece_captured != '--':
+        if move.is_enpassant_move:
+            enpassant_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
+            end_square = p.Rect(move.end_col * SQUARE_SIZE, enpassant_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        background.blit(IMAGES[move.piece_captured], end_square)
+    board_rect = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT)
+    screen.blit(background, board_rect)
+    dirty_rects = [board_rect]
     for frame in range(frame_count + 1):
         row, col = (move.start_row + d_row * frame / frame_count, move.start_col + d_col * frame / frame_count)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        p.draw.rect(screen, color, end_square)
-        # draw captured piece onto rectangle
-        if move.piece_captured != '--':
-            if move.is_enpassant_move:
-                enpassant_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
-                end_square = p.Rect(move.end_col * SQUARE_SIZE, enpassant_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-            screen.blit(IMAGES[move.piece_captured], end_square)
         # draw moving piece
-        screen.blit(IMAGES[move.piece_moved], p.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        p.display.flip()
+        piece_rect = p.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        screen.blit(IMAGES[move.piece_moved], piece_rect)
+        p.display.update(dirty_rects + [piece_rect])
+        screen.blit(background, piece_rect, piece_rect)  # erased in the next frame
+        dirty_rects = [piece_rect]
         clock.tick(60)
 
 
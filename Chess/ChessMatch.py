@@ -0,0 +1,221 @@
+# Plays engine-vs-engine games without a window, in parallel on every core, and streams the results to disk:
+# each finished game is appended to a PGN file and a row of stats to a CSV file. Run it from this directory:
+#   python ChessMatch.py -n 100                                     self-play at the default depth
+#   python ChessMatch.py -n 1000 -a depth=4 -b time=0.5,depth=32 --openings openings.txt
+# Engine settings are the ChessAI.findBestMove limits: depth=, time= (seconds) and nodes=, comma separated, and its
+# search reductions nullmove= and lmr= (plies, 0 switches the pruning off) to A/B test them against each other.
+# Every opening (one FEN per line, the start position by default) is played twice with the colors swapped.
+# With --book both engines play from a Polyglot opening book while the game is in it,
+# with --tablebases both use the endgame tables made by ChessTablebase.py.
+import argparse
+import csv
+import datetime
+import multiprocessing
+import os
+import queue
+import time
+import ChessAI
+import ChessBook
+import ChessEngine
+import ChessTablebase
+
+ENGINE_SETTINGS = {"depth": ("max_depth", int), "time": ("time_limit", float), "nodes": ("node_limit", int),
+                   "nullmove": ("null_move_reduction", int), "lmr": ("late_move_reduction", int)}
+STATS_FIELDS = ("game", "white", "black", "result", "termination", "plies", "seconds",
+                "white_nodes", "black_nodes", "white_depth", "black_depth", "fen")
+MAX_PLIES = 400  # games still going after this many half moves are adjudicated as draws
+
+
+def parseEngine(spec):
+    """
+    Turn an engine setting like "depth=4,time=0.5" into keyword arguments for ChessAI.findBestMove.
+    """
+    settings = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name not in ENGINE_SETTINGS or not value:
+            raise ValueError("Unknown engine setting: " + item)
+        keyword, kind = ENGINE_SETTINGS[name]
+        settings[keyword] = kind(value)
+    return settings
+
+
+def loadOpenings(path):
+    """
+    FENs from a file with one per line, blank lines and lines starting with # are skipped.
+    """
+    openings = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                ChessEngine.GameState(line)  # fail early on a bad FEN
+                openings.append(line)
+    if not openings:
+        raise ValueError("No openings in " + path)
+    return openings
+
+
+def initMatchWorker(book_path, tablebase_path):
+    """
+    Runs once in every worker process. All of them map the same book file, its pages are shared.
+    """
+    if book_path is not None:
+        ChessAI.opening_book = ChessBook.OpeningBook(book_path)
+    if tablebase_path is not None:
+        ChessAI.tablebases = ChessTablebase.Tablebases(tablebase_path)
+
+
+def playGame(task):
+    """
+    Play one game in a worker process. task is (game_number, fen, white, black, max_plies) where white and black are
+    (name, settings) of the engines. Returns the game as PGN and a dict of stats with the STATS_FIELDS.
+    """
+    game_number, fen, white, black, max_plies = task
+    game_state = ChessEngine.GameState(fen)
+    engines = (white, black)
+    tables = (ChessAI.TranspositionTable(), ChessAI.TranspositionTable())  # the engines don't share what they learn
+    nodes = [0, 0]
+    depths = [0, 0]
+    searches = [0, 0]
+    moves = []  # in standard algebraic notation
+    start_time = time.time()
+    while True:
+        valid_moves = game_state.getValidMoves()
+        if game_state.checkmate:
+            result, termination = ("0-1" if game_state.white_to_move else "1-0"), "checkmate"
+            break
+        if game_state.stalemate:
+            result, termination = "1/2-1/2", "stalemate"
+            break
+        draw_reason = game_state.getDrawReason()
+        if draw_reason is not None:
+            result, termination = "1/2-1/2", draw_reason
+            break
+        if len(game_state.move_log) >= max_plies:
+            result, termination = "1/2-1/2", "ply limit"
+            break
+        side = 0 if game_state.white_to_move else 1
+        move, search_stats = ChessAI.findBestMove(game_state, valid_moves, queue.Queue(), table=tables[side],
+                                                  **engines[side][1])
+        if not search_stats.book_move and not search_stats.tablebase_move:  # they would pull the average depth down
+            nodes[side] += search_stats.nodes
+            depths[side] += len(search_stats.depth_times)
+            searches[side] += 1
+        moves.append(game_state.getSanNotation(move))
+        game_state.makeMove(move)
+    stats = {"game": game_number, "white": white[0], "black": black[0], "result": result,
+             "termination": termination, "plies": len(moves), "seconds": round(time.time() - start_time, 2),
+             "white_nodes": nodes[0], "black_nodes": nodes[1],
+             "white_depth": round(depths[0] / max(searches[0], 1), 2),
+             "black_depth": round(depths[1] / max(searches[1], 1), 2), "fen": fen}
+    return makePgn(stats, moves), stats
+
+
+def makePgn(stats, moves):
+    """
+    PGN text of a game from its stats and moves in standard algebraic notation.
+    """
+    fen = stats["fen"]
+    tags = [("Event", "ChessMatch"), ("Site", "?"), ("Date", datetime.date.today().strftime("%Y.%m.%d")),
+            ("Round", str(stats["game"])), ("White", stats["white"]), ("Black", stats["black"]),
+            ("Result", stats["result"]), ("Termination", stats["termination"])]
+    if fen != ChessEngine.START_FEN:
+        tags += [("SetUp", "1"), ("FEN", fen)]
+    fields = fen.split()
+    white_to_move = fields[1] == "w"
+    move_number = int(fields[5]) if len(fields) == 6 else 1
+    tokens = []
+    for move in moves:
+        if white_to_move:
+            tokens.append(str(move_number) + ".")
+        elif not tokens:
+            tokens.append(str(move_number) + "...")
+        tokens.append(move)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(stats["result"])
+    lines = []
+    line = ""
+    for token in tokens:  # PGN lines stay under 80 characters
+        if len(line) + len(token) + 1 > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join('[{} "{}"]'.format(name, value) for name, value in tags) + "\n\n" + "\n".join(lines) + "\n"
+
+
+def runMatch(games, engine_a, engine_b, openings, pgn_path, stats_path, processes=None, max_plies=MAX_PLIES,
+             book_path=None, tablebase_path=None):
+    """
+    Play games between engine_a and engine_b, (name, settings) each, on a pool of processes (default all cores).
+    book_path is a Polyglot opening book both engines play from, tablebase_path a directory of endgame tables.
+    Results are appended to the files as the games finish, in the order they finish, the CSV header only goes into a
+    new stats file. Returns engine_a's wins, draws and losses.
+    """
+    tasks = []
+    for game_number in range(1, games + 1):
+        fen = openings[(game_number - 1) // 2 % len(openings)]
+        if game_number % 2 == 1:
+            tasks.append((game_number, fen, engine_a, engine_b, max_plies))
+        else:
+            tasks.append((game_number, fen, engine_b, engine_a, max_plies))
+    wins = draws = losses = 0
+    new_stats_file = not os.path.exists(stats_path) or os.path.getsize(stats_path) == 0
+    with multiprocessing.Pool(processes, initMatchWorker, (book_path, tablebase_path)) as pool, \
+            open(pgn_path, "a") as pgn_file, open(stats_path, "a", newline="") as stats_file:
+        stats_writer = csv.DictWriter(stats_file, STATS_FIELDS)
+        if new_stats_file:
+            stats_writer.writeheader()
+        for pgn, stats in pool.imap_unordered(playGame, tasks):
+            pgn_file.write(pgn + "\n")
+            pgn_file.flush()
+            stats_writer.writerow(stats)
+            stats_file.flush()
+            a_is_white = stats["game"] % 2 == 1
+            if stats["result"] == "1/2-1/2":
+                draws += 1
+            elif (stats["result"] == "1-0") == a_is_white:
+                wins += 1
+            else:
+                losses += 1
+            print("game {:>5}  {:<7}  {:<16}  {:>4} plies  {:8.1f}s   A +{} ={} -{}".format(
+                stats["game"], stats["result"], stats["termination"], stats["plies"], stats["seconds"],
+                wins, draws, losses))
+    return wins, draws, losses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine-vs-engine games in parallel without a window.")
+    parser.add_argument("-n", "--games", type=int, default=2, help="number of games to play (default 2)")
+    parser.add_argument("-a", "--engine-a", default="depth=" + str(ChessAI.DEPTH),
+                        help="settings of engine A, e.g. depth=4,time=0.5,nodes=20000 (default depth=%(default)s)")
+    parser.add_argument("-b", "--engine-b", help="settings of engine B (default: the same as engine A)")
+    parser.add_argument("--openings", help="file with one opening FEN per line (default: the start position)")
+    parser.add_argument("--pgn", default="games.pgn", help="PGN file the games are appended to (default games.pgn)")
+    parser.add_argument("--stats", default="games.csv",
+                        help="CSV file the per-game stats are appended to (default games.csv)")
+    parser.add_argument("--book", help="Polyglot opening book (.bin) both engines play from")
+    parser.add_argument("--tablebases", help="directory of the endgame tables made by ChessTablebase.py")
+    parser.add_argument("-j", "--processes", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES,
+                        help="adjudicate games as draws after this many half moves (default %(default)s)")
+    args = parser.parse_args()
+    engine_b = args.engine_b or args.engine_a
+    try:
+        engines = [(spec, parseEngine(spec)) for spec in (args.engine_a, engine_b)]
+        openings = loadOpenings(args.openings) if args.openings else [ChessEngine.START_FEN]
+        if args.book:
+            ChessBook.OpeningBook(args.book).close()  # fail early on a missing book
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    wins, draws, losses = runMatch(args.games, engines[0], engines[1], openings, args.pgn, args.stats,
+                                   args.processes, args.max_plies, args.book, args.tablebases)
+    print("A ({}) vs B ({}): +{} ={} -{}".format(args.engine_a, engine_b, wins, draws, losses))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Perft counts the leaf nodes of the legal move tree to a fixed depth.
+# Comparing the counts of well known positions with their published values proves move generation correct,
+# timing them benchmarks it. Run it from this directory:
+#   python ChessPerft.py                      all reference positions to depth 3
+#   python ChessPerft.py -d 4 -p kiwipete     one position, deeper
+#   python ChessPerft.py -d 3 -p start --divide
+#   python ChessPerft.py -d 3 --fen "8/8/8/8/8/8/6k1/4K2R w K - 0 1"
+import argparse
+import sys
+import time
+import ChessEngine
+
+# Reference positions from https://www.chessprogramming.org/Perft_Results with their node counts by depth.
+REFERENCE_POSITIONS = {
+    "start": {
+        "fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        "nodes": [20, 400, 8902, 197281, 4865609, 119060324]},
+    "kiwipete": {
+        "fen": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "nodes": [48, 2039, 97862, 4085603, 193690690]},
+    "position3": {
+        "fen": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        "nodes": [14, 191, 2812, 43238, 674624, 11030083]},
+    "position4": {
+        "fen": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        "nodes": [6, 264, 9467, 422333, 15833292]},
+    "position5": {
+        "fen": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        "nodes": [44, 1486, 62379, 2103487, 89941194]},
+    "position6": {
+        "fen": "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        "nodes": [46, 2079, 89890, 3894594, 164075551]},
+}
+
+
+def loadReferencePosition(name):
+    """
+    New GameState set up in the named reference position.
+    """
+    return ChessEngine.GameState(REFERENCE_POSITIONS[name]["fen"])
+
+
+def perft(game_state, depth):
+    """
+    Number of leaf nodes of the legal move tree depth plies deep.
+    """
+    if depth == 0:
+        return 1
+    moves = game_state.getValidMoveCodes()
+    if depth == 1:
+        return len(moves)  # no need to make the last moves just to count them
+    nodes = 0
+    for move in moves:
+        game_state.makeMove(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undoMove()
+    return nodes
+
+
+def divide(game_state, depth):
+    """
+    Perft split by root move, the usual way to find which move a generator bug hides behind.
+    Returns a list of (Move, nodes).
+    """
+    results = []
+    for move in game_state.getValidMoveCodes():
+        game_state.makeMove(move)
+        results.append((ChessEngine.Move.fromCode(move), perft(game_state, depth - 1)))
+        game_state.undoMove()
+    return results
+
+
+def runPerft(names, max_depth, show_divide=False):
+    """
+    Run perft on the named reference positions for every depth up to max_depth (or as deep as their counts are known)
+    and print nodes, time and nodes/second. Returns True if all counts match.
+    """
+    all_passed = True
+    for name in names:
+        expected_counts = REFERENCE_POSITIONS[name]["nodes"]
+        for depth in range(1, min(max_depth, len(expected_counts)) + 1):
+            game_state = loadReferencePosition(name)
+            start_time = time.perf_counter()
+            if show_divide:
+                results = divide(game_state, depth)
+                nodes = sum(move_nodes for move, move_nodes in results)
+            else:
+                nodes = perft(game_state, depth)
+            elapsed = time.perf_counter() - start_time
+            passed = nodes == expected_counts[depth - 1]
+            all_passed = all_passed and passed
+            if show_divide and depth == max_depth:
+                for move, move_nodes in sorted(results, key=lambda result: result[0].getUciNotation()):
+                    print("    " + move.getUciNotation() + ": " + str(move_nodes))
+            print("{:<10} depth {}  nodes {:>10}  expected {:>10}  {}  {:8.2f}s  {:>8.0f} nps".format(
+                name, depth, nodes, expected_counts[depth - 1], "ok" if passed else "FAILED", elapsed,
+                nodes / elapsed if elapsed > 0 else 0))
+    return all_passed
+
+
+def runFenPerft(fen, depth, show_divide=False):
+    """
+    Perft of any position given as FEN, there is no expected count to check.
+    """
+    game_state = ChessEngine.GameState(fen)
+    start_time = time.perf_counter()
+    results = divide(game_state, depth)
+    elapsed = time.perf_counter() - start_time
+    nodes = sum(move_nodes for move, move_nodes in results)
+    if show_divide:
+        for move, move_nodes in sorted(results, key=lambda result: result[0].getUciNotation()):
+            print("    " + move.getUciNotation() + ": " + str(move_nodes))
+    print("depth {}  nodes {:>10}  {:8.2f}s  {:>8.0f} nps".format(depth, nodes, elapsed,
+                                                                nodes / elapsed if elapsed > 0 else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count and time move generation on reference positions.")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="deepest perft depth to run (default 3)")
+    parser.add_argument("-p", "--position", action="append", choices=sorted(REFERENCE_POSITIONS),
+                        help="position to run, may be repeated (default: all)")
+    parser.add_argument("--divide", action="store_true", help="print the node count of every root move")
+    parser.add_argument("--fen", help="run this position to the given depth instead of the reference positions")
+    args = parser.parse_args()
+    if args.fen:
+        runFenPerft(args.fen, args.depth, args.divide)
+        return
+    names = args.position or list(REFERENCE_POSITIONS)
+    sys.exit(0 if runPerft(names, args.depth, args.divide) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# Endgame tablebases: perfect play for king and queen, rook or pawn against a lone king (KQK, KRK and KPK).
+# Tables are made by retrograde analysis, outwards from the checkmates, and stored one per file in a directory as a
+# flat array of signed bytes, one per position: 0 is a draw (or not a legal position), otherwise the sign is the
+# result for the side to move and abs(value) - 1 the number of half moves to mate with best play.
+# Generate them from this directory once, KPK needs KQK and KRK for its promotions and makes them if needed:
+#   python ChessTablebase.py                    all tables into tablebases/
+#   python ChessTablebase.py KQK KRK -o tables
+# Without tables KBK, KNK and KK are still known to be draws.
+import argparse
+import os
+import time
+from array import array
+import ChessBitboard
+
+TABLES = ("KQK", "KRK", "KPK")
+DEPENDENCIES = {"KPK": ("KQK", "KRK")}  # the tables a pawn promotes into
+DRAWN_PIECES = ("B", "N")  # king and bishop or knight can't mate a lone king
+TABLE_SIZE = 2 * 64 * 64 * 64
+DIRECTORY = "tablebases"
+WHITE, BLACK = 0, 1
+
+
+def tableIndex(side_to_move, white_king, black_king, piece):
+    """
+    Position index in a table, which always has the king and piece on the white side.
+    Squares are row * 8 + col as everywhere else.
+    """
+    return ((side_to_move * 64 + white_king) * 64 + black_king) * 64 + piece
+
+
+def pieceAttacks(piece_type, square, occupied):
+    """
+    Squares the white piece of piece_type ("Q", "R", "B", "N" or "p") on square attacks.
+    """
+    if piece_type == "Q":
+        return ChessBitboard.queenAttacks(square, occupied)
+    if piece_type == "R":
+        return ChessBitboard.rookAttacks(square, occupied)
+    if piece_type == "B":
+        return ChessBitboard.bishopAttacks(square, occupied)
+    if piece_type == "N":
+        return ChessBitboard.KNIGHT_ATTACKS[square]
+    return ChessBitboard.PAWN_ATTACKS["w"][square]
+
+
+def isLegal(piece_type, side_to_move, white_king, black_king, piece):
+    """
+    The pieces are on different squares, the kings not next to each other, a pawn not on the first or last rank,
+    and the side that just moved didn't leave its king in check (only the black king can be in check).
+    """
+    if white_king == black_king or piece == white_king or piece == black_king:
+        return False
+    if ChessBitboard.KING_ATTACKS[white_king] >> black_king & 1:
+        return False
+    if piece_type == "p" and not 1 <= piece >> 3 <= 6:
+        return False
+    if side_to_move == WHITE:
+        return not pieceAttacks(piece_type, piece, 1 << white_king | 1 << black_king) >> black_king & 1
+    return True
+
+
+def generateMoves(piece_type, side_to_move, white_king, black_king, piece):
+    """
+    The moves of a legal position: a list of the table indexes it can move to and a list of the positions it leaves
+    the table for, as ("K", None) after the black king takes the piece or (promotion piece, index) for promotions.
+    """
+    occupied = 1 << white_king | 1 << black_king | 1 << piece
+    children = []
+    exits = []
+    if side_to_move == WHITE:
+        kings = ChessBitboard.KING_ATTACKS[white_king] & ~ChessBitboard.KING_ATTACKS[black_king] & ~(1 << piece)
+        for square in ChessBitboard.squares(kings):
+            children.append(tableIndex(BLACK, square, black_king, piece))
+        if piece_type == "p":
+            one_step = piece - 8
+            if not occupied >> one_step & 1:
+                if one_step < 8:  # promotion
+                    for promotion in ("Q", "R", "B", "N"):
+                        exits.append((promotion, tableIndex(BLACK, white_king, black_king, one_step)))
+                else:
+                    children.append(tableIndex(BLACK, white_king, black_king, one_step))
+                    if piece >> 3 == 6 and not occupied >> (piece - 16) & 1:
+                        children.append(tableIndex(BLACK, white_king, black_king, piece - 16))
+        else:
+            targets = pieceAttacks(piece_type, piece, occupied) & ~occupied
+            for square in ChessBitboard.squares(targets):
+                children.append(tableIndex(BLACK, white_king, black_king, square))
+    else:
+        # the black king doesn't block the squares behind it from a slider
+        attacked = ChessBitboard.KING_ATTACKS[white_king] | pieceAttacks(piece_type, piece, 1 << white_king)
+        for square in ChessBitboard.squares(ChessBitboard.KING_ATTACKS[black_king] & ~attacked):
+            if square == piece:
+                exits.append(("K", None))
+            else:
+                children.append(tableIndex(WHITE, white_king, square, piece))
+    return children, exits
+
+
+def generatePredecessors(piece_type, side_to_move, white_king, black_king, piece):
+    """
+    The legal positions that reach this one with a move that stays in the table: the opposite of generateMoves.
+    """
+    occupied = 1 << white_king | 1 << black_king | 1 << piece
+    parents = []
+    if side_to_move == BLACK:  # white moved last
+        kings = ChessBitboard.KING_ATTACKS[white_king] & ~ChessBitboard.KING_ATTACKS[black_king] & ~occupied
+        for square in ChessBitboard.squares(kings):
+            if isLegal(piece_type, WHITE, square, black_king, piece):
+                parents.append(tableIndex(WHITE, square, black_king, piece))
+        if piece_type == "p":
+            origins = []
+            if piece >> 3 <= 5 and not occupied >> (piece + 8) & 1:
+                origins.append(piece + 8)
+                if piece >> 3 == 4 and not occupied >> (piece + 16) & 1:
+                    origins.append(piece + 16)
+        else:  # sliders and knights move back along the same lines
+            origins = ChessBitboard.squares(pieceAttacks(piece_type, piece, occupied) & ~occupied)
+        for square in origins:
+            if isLegal(piece_type, WHITE, white_king, black_king, square):
+                parents.append(tableIndex(WHITE, white_king, black_king, square))
+    else:  # the black king moved last
+        kings = ChessBitboard.KING_ATTACKS[black_king] & ~ChessBitboard.KING_ATTACKS[white_king] & ~occupied
+        for square in ChessBitboard.squares(kings):
+            parents.append(tableIndex(BLACK, white_king, square, piece))
+    return parents
+
+
+def generateTable(name, tables):
+    """
+    Make the table for name ("KQK", ...) by retrograde analysis. tables holds the finished tables by name, those in
+    DEPENDENCIES[name] have to be in it. Returns the table as an array of signed bytes.
+    """
+    piece_type = "p" if name[1] == "P" else name[1]
+    table = array("b", bytes(TABLE_SIZE))
+    remaining = array("b", bytes(TABLE_SIZE))  # moves whose result isn't known yet, for positions still undecided
+    longest_loss = array("b", bytes(TABLE_SIZE))  # the most half moves a decided move lets the opponent survive
+    can_avoid_loss = bytearray(TABLE_SIZE)  # has a move that draws or wins, so the position is never lost
+    buckets = [[]]  # buckets[half moves to mate] = [(index, the side to move wins)], worked through in order
+
+    def push(index, half_moves, wins):
+        while len(buckets) <= half_moves:
+            buckets.append([])
+        buckets[half_moves].append((index, wins))
+
+    for index in range(TABLE_SIZE):
+        side_to_move, squares = divmod(index, 64 * 64 * 64)
+        white_king, squares = divmod(squares, 64 * 64)
+        black_king, piece = divmod(squares, 64)
+        if not isLegal(piece_type, side_to_move, white_king, black_king, piece):
+            continue
+        children, exits = generateMoves(piece_type, side_to_move, white_king, black_king, piece)
+        remaining[index] = len(children)
+        for promotion, child in exits:
+            if promotion == "K" or promotion in DRAWN_PIECES:
+                value = 0
+            else:
+                value = tables["K" + promotion + "K"][child]
+            if value < 0:  # the opponent is mated in -value - 1
+                push(index, -value, True)
+                can_avoid_loss[index] = 1
+            elif value > 0:
+                longest_loss[index] = max(longest_loss[index], value - 1)
+            else:
+                can_avoid_loss[index] = 1
+        if not children and not can_avoid_loss[index]:
+            if exits:  # every way out of the table loses
+                push(index, longest_loss[index] + 1, False)
+            elif side_to_move == BLACK and not isLegal(piece_type, WHITE, white_king, black_king, piece):
+                push(index, 0, False)  # checkmate
+            # stalemate stays a draw
+
+    half_moves = 0
+    while half_moves < len(buckets):
+        for index, wins in buckets[half_moves]:
+            if table[index] != 0:
+                continue  # decided in fewer half moves already
+            table[index] = half_moves + 1 if wins else -(half_moves + 1)
+            side_to_move, squares = divmod(index, 64 * 64 * 64)
+            white_king, squares = divmod(squares, 64 * 64)
+            black_king, piece = divmod(squares, 64)
+            for parent in generatePredecessors(piece_type, side_to_move, white_king, black_king, piece):
+                if table[parent] != 0:
+                    continue
+                if not wins:  # the parent wins by moving here
+                    push(parent, half_moves + 1, True)
+                else:
+                    remaining[parent] -= 1
+                    longest_loss[parent] = max(longest_loss[parent], half_moves)
+                    if remaining[parent] == 0 and not can_avoid_loss[parent]:
+                        push(parent, longest_loss[parent] + 1, False)
+        buckets[half_moves] = None
+        half_moves += 1
+    return table
+
+
+def saveTable(table, name, directory=DIRECTORY):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name + ".bin"), "wb") as file:
+        table.tofile(file)
+
+
+def loadTable(name, directory=DIRECTORY):
+    table = array("b")
+    with open(os.path.join(directory, name + ".bin"), "rb") as file:
+        table.fromfile(file, TABLE_SIZE)
+    return table
+
+
+class Tablebases:
+    """
+    The tables found in a directory, probed with GameStates.
+    """
+
+    def __init__(self, directory=DIRECTORY):
+        self.directory = directory
+        self.tables = {}
+        for name in TABLES:
+            if os.path.exists(os.path.join(directory, name + ".bin")):
+                self.tables[name] = loadTable(name, directory)
+
+    def probe(self, game_state):
+        """
+        The table value of the position (see the top of this file) for the side to move,
+        or None if there are more than three pieces or the table isn't loaded.
+        """
+        occupied = game_state.occupancy["w"] | game_state.occupancy["b"]
+        if ChessBitboard.popCount(occupied) > 3:
+            return None
+        white_king = ChessBitboard.lowestSquare(game_state.bitboards["wK"])
+        black_king = ChessBitboard.lowestSquare(game_state.bitboards["bK"])
+        side_to_move = WHITE if game_state.white_to_move else BLACK
+        for name, bitboard in game_state.bitboards.items():
+            if bitboard and name[1] != "K":
+                piece_name, piece = name, ChessBitboard.lowestSquare(bitboard)
+                break
+        else:
+            return 0  # two bare kings
+        if piece_name[1] in DRAWN_PIECES:
+            return 0
+        table = self.tables.get("K" + piece_name[1].upper() + "K")
+        if table is None:
+            return None
+        if piece_name[0] == "b":  # the tables have the piece on the white side, so swap the colors and flip the board
+            white_king, black_king, piece = black_king ^ 56, white_king ^ 56, piece ^ 56
+            side_to_move = 1 - side_to_move
+        return table[tableIndex(side_to_move, white_king, black_king, piece)]
+
+    def findBestMove(self, game_state):
+        """
+        The move with the best table result, winning as fast or losing as slowly as possible, as a move code.
+        None if the position or one after its moves can't be probed, or there are no moves.
+        """
+        best_move = None
+        best_rank = None
+        for move in game_state.getValidMoveCodes():
+            game_state.makeMove(move)
+            value = self.probe(game_state)
+            game_state.undoMove()
+            if value is None:
+                return None
+            # rank moves by the result for the mover: the quickest win first, then draws, then the slowest loss
+            if value < 0:
+                rank = (2, value)
+            elif value == 0:
+                rank = (1, 0)
+            else:
+                rank = (0, value)
+            if best_rank is None or rank > best_rank:
+                best_move, best_rank = move, rank
+        return best_move
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases by retrograde analysis.")
+    parser.add_argument("tables", nargs="*", metavar="table",
+                        help="tables to make, any of {} (default: all)".format(", ".join(TABLES)))
+    parser.add_argument("-o", "--output", default=DIRECTORY, help="directory for the tables (default %(default)s)")
+    args = parser.parse_args()
+    # checked here, argparse checks even the empty list of nargs="*" against choices
+    for name in args.tables:
+        if name not in TABLES:
+            parser.error("unknown table {} (choose from {})".format(name, ", ".join(TABLES)))
+    tables = {}
+    for name in args.tables or list(TABLES):
+        for dependency in DEPENDENCIES.get(name, ()) + (name,):
+            if dependency in tables:
+                continue
+            if dependency != name and os.path.exists(os.path.join(args.output, dependency + ".bin")):
+                tables[dependency] = loadTable(dependency, args.output)
+                continue
+            start_time = time.time()
+            tables[dependency] = generateTable(dependency, tables)
+            saveTable(tables[dependency], dependency, args.output)
+            table = tables[dependency]
+            print("{}  {:6.1f}s  wins {:>6}  losses {:>6}  longest mate {} half moves".format(
+                dependency, time.time() - start_time, sum(1 for value in table if value > 0),
+                sum(1 for value in table if value < 0), max(abs(value) for value in table) - 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# UCI front end, so that chess GUIs, tournament managers and analysis tools can drive the engine.
+# Run it from this directory: python ChessUci.py
+# Supported commands: uci, isready, ucinewgame, position [startpos | fen <fen>] [moves ...],
+# go [depth | movetime | wtime btime winc binc movestogo | nodes | infinite], stop, quit and
+# setoption name BookFile value <path of a Polyglot .bin book, <empty> for none>,
+# setoption name TablebasePath value <directory of the ChessTablebase tables, <empty> for none>,
+# setoption name NullMoveReduction value <plies> and setoption name LateMoveReduction value <plies> (0 switches
+# that pruning off).
+# The search runs on its own thread while this one keeps reading commands, so stop and isready are answered at once.
+import sys
+import threading
+import ChessAI
+import ChessBook
+import ChessEngine
+import ChessTablebase
+
+
+def uciScore(pv):
+    """
+    The score of a principal variation as UCI gives it: "cp <centipawns>", or "mate <moves>" for a mate the search
+    or the tablebases found, negative when the side to move gets mated.
+    """
+    if abs(pv.score) < ChessAI.TABLEBASE_WIN - 1:
+        return "cp {}".format(round(pv.score * 100))
+    half_moves = len(pv.moves)  # a checkmate is at the end of the line
+    if abs(pv.score) < ChessAI.CHECKMATE:  # the line ends in a tablebase position that counts its half moves to mate
+        half_moves += round((ChessAI.TABLEBASE_WIN - abs(pv.score)) / 0.01)
+    moves = (half_moves + 1) // 2
+    return "mate {}".format(moves if pv.score > 0 else -moves)
+
+
+class InfoReporter:
+    """
+    Takes the place of findBestMove's return_queue and sends an info line for every completed depth, from the
+    SearchStats the search counts in.
+    """
+
+    def __init__(self, engine, stats):
+        self.engine = engine
+        self.stats = stats
+
+    def put(self, move):
+        stats = self.stats
+        pv = stats.principal_variation
+        # scores are in pawns from the side to move's view
+        self.engine.send("info depth {} score {} nodes {} nps {} time {} pv {}".format(
+            pv.depth, uciScore(pv), stats.nodes, int(stats.nodesPerSecond()),
+            int(stats.elapsed() * 1000), pv))
+
+
+class UciEngine:
+    def __init__(self, output):
+        self.output = output
+        self.game_state = ChessEngine.GameState()
+        self.search_thread = None
+        self.stop_event = threading.Event()
+        self.null_move_reduction = ChessAI.NULL_MOVE_REDUCTION
+        self.late_move_reduction = ChessAI.LATE_MOVE_REDUCTION
+
+    def send(self, line):
+        self.output.write(line + "\n")
+        self.output.flush()
+
+    def handle(self, line):
+        """
+        Act on one line of input. Returns False once the engine should quit.
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name chess-python")
+            self.send("id author noumxn")
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("option name NullMoveReduction type spin default {} min 0 max 4".format(
+                ChessAI.NULL_MOVE_REDUCTION))
+            self.send("option name LateMoveReduction type spin default {} min 0 max 3".format(
+                ChessAI.LATE_MOVE_REDUCTION))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stopSearch()
+            ChessAI.transposition_table.clear()
+            self.game_state = ChessEngine.GameState()
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(tokens[1:])
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(tokens[1:])
+        elif command == "go":
+            self.stopSearch()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        return True  # unknown commands are ignored, as the protocol asks
+
+    def setOption(self, tokens):
+        """
+        setoption name <name> value <value>
+        """
+        if "name" not in tokens:
+            return
+        if "value" in tokens:
+            name = " ".join(tokens[tokens.index("name") + 1:tokens.index("value")])
+            value = " ".join(tokens[tokens.index("value") + 1:])
+        else:
+            name = " ".join(tokens[tokens.index("name") + 1:])
+            value = ""
+        if name.lower() == "bookfile":
+            if ChessAI.opening_book is not None:
+                ChessAI.opening_book.close()
+                ChessAI.opening_book = None
+            if value and value != "<empty>":
+                try:
+                    ChessAI.opening_book = ChessBook.OpeningBook(value)
+                except (OSError, ValueError) as error:
+                    self.send("info string " + str(error))
+        elif name.lower() == "tablebasepath":
+            ChessAI.tablebases = None
+            if value and value != "<empty>":
+                ChessAI.tablebases = ChessTablebase.Tablebases(value)
+                if not ChessAI.tablebases.tables:
+                    self.send("info string No tablebases in " + value)
+        elif name.lower() == "nullmovereduction" and value.isdigit():
+            self.null_move_reduction = min(int(value), 4)
+        elif name.lower() == "latemovereduction" and value.isdigit():
+            self.late_move_reduction = min(int(value), 3)
+
+    def setPosition(self, tokens):
+        """
+        position startpos [moves ...] or position fen <fen> [moves ...]
+        """
+        if "moves" in tokens:
+            moves = tokens[tokens.index("moves") + 1:]
+            tokens = tokens[:tokens.index("moves")]
+        else:
+            moves = []
+        try:
+            if tokens[:1] == ["fen"]:
+                game_state = ChessEngine.GameState(" ".join(tokens[1:]))
+            else:
+                game_state = ChessEngine.GameState()
+            for notation in moves:
+                for move in game_state.getValidMoves():
+                    if move.getUciNotation() == notation:
+                        game_state.makeMove(move)
+                        break
+                else:
+                    raise ValueError("Illegal move " + notation)
+        except ValueError as error:
+            self.send("info string " + str(error))
+            return
+        self.game_state = game_state
+
+    def go(self, tokens):
+        """
+        Start a search with the limits of a go command. Without limits it runs until stop. With infinite the
+        bestmove waits for stop even when the search ends by itself.
+        """
+        options = {}
+        for i in range(len(tokens) - 1):
+            if tokens[i] in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes") and \
+                    tokens[i + 1].lstrip("-").isdigit():
+                options[tokens[i]] = int(tokens[i + 1])
+        # the killer moves and the principal variation only have room for MAX_PLY plies
+        max_depth = min(max(options.get("depth", ChessAI.MAX_DEPTH), 1), ChessAI.MAX_PLY)
+        node_limit = options.get("nodes")
+        time_limit = None
+        if "movetime" in options:
+            time_limit = options["movetime"] / 1000
+        else:
+            remaining = options.get("wtime" if self.game_state.white_to_move else "btime")
+            if remaining is not None:
+                increment = options.get("winc" if self.game_state.white_to_move else "binc", 0)
+                moves_to_go = options.get("movestogo", 30)
+                # an even share of the clock plus most of the increment, always leaving some time in hand
+                time_limit = max(min(remaining / moves_to_go + increment * 0.8, remaining * 0.5), 10) / 1000
+        self.stop_event.clear()
+        self.search_thread = threading.Thread(target=self.search, args=(max_depth, time_limit, node_limit,
+                                                                             "infinite" in tokens), daemon=True)
+        self.search_thread.start()
+
+    def search(self, max_depth, time_limit, node_limit, infinite):
+        """
+        Runs on the search thread, sends bestmove when done, or after stop when infinite.
+        """
+        game_state = self.game_state
+        valid_moves = game_state.getValidMoves()
+        if len(valid_moves) == 0:
+            if infinite:
+                self.stop_event.wait()
+            self.send("bestmove 0000")
+            return
+        reporter = InfoReporter(self, ChessAI.SearchStats())
+        best_move, stats = ChessAI.findBestMove(game_state, valid_moves, reporter, max_depth, time_limit, node_limit,
+                                                stop=self.stop_event.is_set,
+                                                null_move_reduction=self.null_move_reduction,
+                                                late_move_reduction=self.late_move_reduction, stats=reporter.stats)
+        self.send("info string " + str(stats))
+        if best_move is None:  # stopped before depth 1 was done, any legal move beats none
+            best_move = valid_moves[0]
+        if infinite:
+            self.stop_event.wait()
+        self.send("bestmove " + best_move.getUciNotation())
+
+    def stopSearch(self):
+        """
+        Stop the running search, if any, and wait for it to send its bestmove.
+        """
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+
+def main():
+    engine = UciEngine(sys.stdout)
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+
+
+if __name__ == "__main__":
+    main()
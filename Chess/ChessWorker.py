@@ -0,0 +1,158 @@
+# Long-lived AI process for the game window.
+# The window keeps an EngineWorker and tells it every move made on its board, the worker follows along on its own
+# GameState. Searches run in the same process every time, so the transposition table stays warm between moves,
+# and a search that is no longer wanted is cancelled instead of killing the process. A parallel search keeps its
+# pool of processes, and their tables, for the life of the worker too.
+# Messages to the worker, over a Pipe:
+#   ("position", fen)                          set up a new game
+#   ("move", code) / ("undo",)                 follow the moves made on the board
+#   ("go", search_id, max_depth, time_limit)   search the current position
+#   ("quit",)
+# Messages back: ("best", search_id, code) after every completed depth and ("done", search_id, code or None).
+import atexit
+from multiprocessing import Pipe, Process, Value
+import ChessAI
+import ChessBook
+import ChessEngine
+import ChessTablebase
+
+
+class SearchStop:
+    """
+    stop function for ChessAI.findBestMove: True once the search it belongs to is not the active search any more.
+    """
+
+    def __init__(self, active_search, search_id):
+        self.active_search = active_search
+        self.search_id = search_id
+
+    def __call__(self):
+        return self.active_search.value != self.search_id
+
+
+class ConnectionQueue:
+    """
+    Sends the moves ChessAI.findBestMove puts on its return_queue back over the pipe, as move codes.
+    """
+
+    def __init__(self, connection, search_id):
+        self.connection = connection
+        self.search_id = search_id
+
+    def put(self, move):
+        self.connection.send(("best", self.search_id, move.code))
+
+
+def runWorker(connection, active_search, processes, book_path, tablebase_path):
+    """
+    Main loop of the worker process.
+    """
+    if book_path is not None:
+        ChessAI.opening_book = ChessBook.OpeningBook(book_path)
+    if tablebase_path is not None:
+        ChessAI.tablebases = ChessTablebase.Tablebases(tablebase_path)
+    game_state = ChessEngine.GameState()
+    pool = ChessAI.SearchPool(processes) if processes != 1 else None
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break  # the window is gone
+        command = message[0]
+        if command == "position":
+            game_state = ChessEngine.GameState(message[1])
+        elif command == "move":
+            game_state.makeMove(message[1])
+        elif command == "undo":
+            game_state.undoMove()
+        elif command == "go":
+            search_id, max_depth, time_limit = message[1:]
+            best_move = None
+            valid_moves = game_state.getValidMoves()
+            if active_search.value == search_id and len(valid_moves) > 0:  # not cancelled while waiting in the pipe
+                stop = SearchStop(active_search, search_id)
+                return_queue = ConnectionQueue(connection, search_id)
+                if pool is None:
+                    best_move, _ = ChessAI.findBestMove(game_state, valid_moves, return_queue, max_depth, time_limit,
+                                                        stop=stop)
+                else:
+                    best_move, _ = ChessAI.findBestMoveParallel(game_state, valid_moves, return_queue, max_depth,
+                                                                time_limit, stop=stop, pool=pool)
+            connection.send(("done", search_id, best_move.code if best_move is not None else None))
+        elif command == "quit":
+            break
+    if pool is not None:
+        pool.close()
+
+
+class EngineWorker:
+    """
+    The window's side of the worker process. Every method returns at once, the search runs in the background.
+    """
+
+    def __init__(self, processes=1, fen=ChessEngine.START_FEN, book_path=None, tablebase_path=None):
+        # processes is passed on to the search, more than 1 uses ChessAI.findBestMoveParallel (None for all cores)
+        # book_path is a Polyglot opening book the worker plays from while the position is in it
+        # tablebase_path is a directory of ChessTablebase tables the search probes
+        self.connection, worker_connection = Pipe()
+        self.active_search = Value("i", 0)  # id of the search the window still waits for, 0 for none
+        self.search_id = 0
+        self.best_move = None
+        self.search_finished = False
+        # not a daemon, those can't start the process pool of a parallel search, so close it at exit instead
+        self.process = Process(target=runWorker, args=(worker_connection, self.active_search, processes, book_path,
+                                                             tablebase_path))
+        self.process.start()
+        atexit.register(self.close)
+        self.newGame(fen)
+
+    def newGame(self, fen=ChessEngine.START_FEN):
+        self.stopSearch()
+        self.connection.send(("position", fen))
+
+    def makeMove(self, move):
+        """
+        Play a Move or move code on the worker's board.
+        """
+        self.connection.send(("move", move if type(move) is int else move.code))
+
+    def undoMove(self):
+        self.stopSearch()
+        self.connection.send(("undo",))
+
+    def startSearch(self, max_depth=ChessAI.MAX_DEPTH, time_limit=None):
+        """
+        Search the worker's position, poll for the result.
+        """
+        self.search_id += 1
+        self.active_search.value = self.search_id
+        self.best_move = None
+        self.search_finished = False
+        self.connection.send(("go", self.search_id, max_depth, time_limit))
+
+    def stopSearch(self):
+        """
+        Cancel the running search, if any. The worker drops it at its next check and is free for the next command.
+        """
+        self.active_search.value = 0
+
+    def poll(self):
+        """
+        Read what the worker has sent so far. Returns the best Move of the running search up to now (or None)
+        and whether that search has finished.
+        """
+        while self.connection.poll():
+            message, search_id, code = self.connection.recv()
+            if search_id != self.search_id or self.active_search.value != search_id:
+                continue  # left over from a cancelled search
+            if code is not None:
+                self.best_move = ChessEngine.Move.fromCode(code)
+            if message == "done":
+                self.search_finished = True
+        return self.best_move, self.search_finished
+
+    def close(self):
+        if self.process.is_alive():
+            self.stopSearch()
+            self.connection.send(("quit",))
+            self.process.join()